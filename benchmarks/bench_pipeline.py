@@ -0,0 +1,207 @@
+# Benchmark do pipeline por etapa, sobre bases sintéticas (ver synthetic.py):
+# leitura de cada arquivo, reprojeção, índice espacial, as duas consultas
+# espaciais, agregação, merges, conflitos, busca (search_oae) e geração do
+# mapa: HTML do Folium (create_map) e JSON do deck.gl (create_deck). O
+# resultado é gravado em JSON para acompanhar regressões entre versões.
+#
+# Uso: python benchmarks/bench_pipeline.py [--sizes 1000 10000 ...] [--repeats 3]
+#          [--output bench_pipeline.json] [--baseline anterior.json] [--skip-map]
+#          [--workers N]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import pipeline  # noqa: E402
+import synthetic  # noqa: E402
+
+# Consultas da etapa search_oae: trechos de código, início de palavra e
+# trechos no meio da descrição, como digitados na caixa de busca
+SEARCH_QUERIES = ['0', '01', '123', 'ponte', 'viad', 'rio 1', 'sobre o', 'passarela sobre', 'tunel', 'rio 99']
+
+
+class StageTimer:
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.runs = {}
+
+    def measure(self, name, fn, *args, **kwargs):
+        # Executa fn `repeats` vezes e devolve o último resultado. Etapas com o
+        # mesmo nome têm os tempos somados (uma etapa em mais de uma chamada).
+        times = []
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+        if name in self.runs:
+            times = [a + b for a, b in zip(self.runs[name], times)]
+        self.runs[name] = times
+        return result
+
+    def summary(self):
+        return {
+            name: {'min': min(times), 'median': statistics.median(times), 'runs': times}
+            for name, times in self.runs.items()
+        }
+
+
+def read_concurrently(paths):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(pipeline.read_oae_base, paths['base_oae_colep']),
+            executor.submit(pipeline.read_sgo, paths['23012025_relatoriosEmLote']),
+            executor.submit(pipeline.read_zipped_shapefile, paths['SNV_202501A'], columns=pipeline.SNV_COLUMNS),
+            executor.submit(pipeline.read_zipped_shapefile, paths['BR_UF_2022'], columns=pipeline.UF_COLUMNS),
+        ]
+        return [future.result() for future in futures]
+
+
+def bench_size(n_oae, data_dir, repeats=3, seed=0, skip_map=False, workers=1):
+    # Gera (ou reaproveita) as bases deste tamanho e mede cada etapa
+    size_dir = os.path.join(data_dir, f'oae-{n_oae}-seed-{seed}')
+    paths = {key: os.path.join(size_dir, name) for key, name in synthetic.FILE_NAMES.items()}
+    if not all(os.path.exists(path) for path in paths.values()):
+        synthetic.generate(n_oae, size_dir, seed=seed)
+
+    timer = StageTimer(repeats)
+    # 1. Leitura dos arquivos
+    v_oae = timer.measure('ingest_excel', pipeline.read_oae_base, paths['base_oae_colep'])
+    v_sgo = timer.measure('ingest_sgo_csv', pipeline.read_sgo, paths['23012025_relatoriosEmLote'])
+    v_snv = timer.measure('ingest_snv_shapefile', pipeline.read_zipped_shapefile, paths['SNV_202501A'], columns=pipeline.SNV_COLUMNS)
+    v_uf = timer.measure('ingest_uf_shapefile', pipeline.read_zipped_shapefile, paths['BR_UF_2022'], columns=pipeline.UF_COLUMNS)
+    # Os quatro arquivos ao mesmo tempo, como em process_data: o tempo deve
+    # ficar próximo ao do arquivo mais lento
+    timer.measure('ingest_concurrent', read_concurrently, paths)
+
+    # 2. Reprojeção (OAEs, SNV e UFs) e índice espacial (inclui de novo a
+    # reprojeção do SNV e das UFs, como na primeira carga do app)
+    crs = v_snv.crs
+    points_gdf = timer.measure('reproject', pipeline.project_oae, v_oae, crs)
+    timer.measure('reproject', lambda: (v_snv.to_crs(epsg=pipeline.PROJECTED_CRS), v_uf.to_crs(epsg=pipeline.PROJECTED_CRS)))
+    index = timer.measure('spatial_index', pipeline.build_spatial_index, v_snv, v_uf)
+
+    # 3. As duas consultas espaciais e a montagem de df_merged
+    points = np.asarray(points_gdf.geometry.array)
+    timer.measure('sjoin_snv', pipeline.query_snv, index, points)
+    if workers > 1:
+        # Mesma consulta em blocos espaciais, em `workers` processos (inclui a
+        # criação do pool)
+        timer.measure('sjoin_snv_partitioned', pipeline.query_snv_partitioned, index, points, workers)
+    timer.measure('sjoin_uf', pipeline.query_uf, index, points)
+    df_merged = timer.measure('join_rows', pipeline.join_oae, points_gdf, index)
+
+    # 4 a 8. Agregação, merges e conflitos
+    df_grouped = timer.measure('aggregate', pipeline.group_oae, df_merged)
+    df_sgo = timer.measure('merges', pipeline.merge_sgo, df_grouped, v_sgo)
+    df_flagged = timer.measure('conflicts', pipeline.flag_conflicts, df_sgo)
+    df_oae = timer.measure('merges', pipeline.merge_pnv, df_flagged, index['snv'])
+    df_oae = timer.measure('finalize', pipeline.finalize_oae, df_oae)
+    df_snv = timer.measure('snv_lod', pipeline.build_snv_lod, index['snv'])
+
+    if not skip_map:
+        # O app importa o Streamlit; fora do `streamlit run`, roda em modo bare
+        import mapa
+        search_index = timer.measure('search_index', mapa.build_search_index, df_oae)
+        timer.measure('search_oae', lambda: [mapa.search_oae(q, search_index) for q in SEARCH_QUERIES])
+        map_snv = df_snv[df_snv['ds_tipo_ad'].astype(str).isin(mapa.color_map.keys())]
+        timer.measure('create_map', lambda: mapa.render_map_html(mapa.create_map(map_snv, df_oae)))
+        timer.measure('create_deck', lambda: mapa.create_deck(map_snv, df_oae).to_json())
+
+    return {
+        'n_oae': n_oae,
+        'rows': {
+            'oae_input': len(v_oae), 'snv': len(v_snv), 'sgo': len(v_sgo),
+            'merged': len(df_merged), 'oae_output': len(df_oae),
+        },
+        'stages': timer.summary(),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import geopandas
+    import pandas
+    import shapely
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'pipeline_version': pipeline.PIPELINE_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {
+            'numpy': np.__version__, 'pandas': pandas.__version__,
+            'geopandas': geopandas.__version__, 'shapely': shapely.__version__,
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    # Razão das medianas (atual / anterior) por tamanho e etapa; marca as
+    # etapas que ficaram mais lentas que `threshold`
+    previous = {r['n_oae']: r['stages'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old_stages = previous.get(result['n_oae'])
+        if old_stages is None:
+            continue
+        for name, stats in result['stages'].items():
+            if name not in old_stages:
+                continue
+            ratio = stats['median'] / old_stages[name]['median'] if old_stages[name]['median'] else float('inf')
+            flag = '  <-- regressão' if ratio > threshold else ''
+            print(f"  {result['n_oae']:>7} {name:<22} {ratio:6.2f}x{flag}")
+            if flag:
+                regressions.append((result['n_oae'], name, ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline do mapa OAE por etapa.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Números de OAEs (1000 a 500000)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'mapa_oae_bench'),
+                        help='Onde guardar as bases sintéticas geradas (reaproveitadas entre execuções)')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--baseline', help='JSON de uma execução anterior, para comparação')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Razão a partir da qual a etapa é uma regressão')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processos da consulta particionada ao SNV (sjoin_snv_partitioned, se > 1)')
+    parser.add_argument('--skip-map', action='store_true', help='Não mede search_oae nem create_map (sem Streamlit/folium)')
+    args = parser.parse_args()
+
+    results = []
+    for n_oae in args.sizes:
+        result = bench_size(n_oae, args.data_dir, args.repeats, args.seed, args.skip_map, args.workers)
+        results.append(result)
+        print(f"OAEs: {n_oae}  linhas após os joins: {result['rows']['merged']}")
+        for name, stats in result['stages'].items():
+            print(f"  {name:<22} {stats['median']:8.3f} s  (mín. {stats['min']:.3f} s)")
+
+    report = dict(environment(), repeats=args.repeats, results=results)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados gravados em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Comparação com {args.baseline} (mediana atual / anterior):")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
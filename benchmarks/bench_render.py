@@ -0,0 +1,63 @@
+# Benchmark de create_map: tempo de construção e tamanho do HTML gerado para
+# cada modo de renderização das OAEs (OAE_RENDER_MODES).
+#
+# Uso: python benchmarks/bench_render.py [n_oae] [n_snv]
+import os
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mapa import OAE_RENDER_MODES, color_map, create_map  # noqa: E402
+
+
+def synthetic_frames(n_oae, n_snv, seed=0):
+    # df_snv / df_oae com as colunas usadas por create_map
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-73, -35, n_snv)
+    y = rng.uniform(-33, 4, n_snv)
+    df_snv = gpd.GeoDataFrame({
+        'vl_br': rng.integers(10, 500, n_snv).astype(str),
+        'sg_uf': rng.choice(['MG', 'SP', 'BA'], n_snv),
+        'vl_codigo': [f'{i:06d}' for i in range(n_snv)],
+        'ds_coinc': '',
+        'ds_tipo_ad': rng.choice(list(color_map.keys()), n_snv),
+        'ds_jurisdi': 'Federal',
+        'ds_superfi': 'PAV',
+        'ul': 'UL1',
+    }, geometry=[LineString([(a, b), (a + 0.05, b + 0.05)]) for a, b in zip(x, y)], crs=4674).to_crs(5880)
+
+    lat = rng.uniform(-33, 4, n_oae).round(6)
+    lon = rng.uniform(-73, -35, n_oae).round(6)
+    df_oae = pd.DataFrame({
+        'cod_sgo': [f'{i:06d}' for i in range(n_oae)],
+        'descr_obra': [f'Ponte sobre o Rio {i}' for i in range(n_oae)],
+        'tipo_obra': rng.choice(['Ponte', 'Viaduto'], n_oae),
+        'nota_sgo': rng.choice(['1', '2', '3', 'Sem nota'], n_oae),
+        'br': rng.integers(10, 500, n_oae).astype(str),
+        'uf_2': rng.choice(['MG', 'SP', 'BA', 'MG;SP'], n_oae),
+        'latitude': lat,
+        'longitude': lon,
+    })
+    df_oae['streetview_link'] = "https://www.google.com/maps?q=&layer=c&cbll=" + lat.astype(str) + "," + lon.astype(str)
+    return df_snv, df_oae
+
+
+if __name__ == '__main__':
+    n_oae = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_snv = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    df_snv, df_oae = synthetic_frames(n_oae, n_snv)
+
+    # Aquecimento: a primeira chamada de explore importa mapclassify
+    create_map(df_snv, df_oae.head(1)).get_root().render()
+
+    print(f"OAEs: {n_oae}  segmentos SNV: {n_snv}")
+    for label, mode in OAE_RENDER_MODES.items():
+        start = time.perf_counter()
+        html = create_map(df_snv, df_oae, oae_mode=mode).get_root().render()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<26} {elapsed:8.3f} s  {len(html.encode()) / 1024 ** 2:8.2f} MB")
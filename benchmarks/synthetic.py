@@ -0,0 +1,178 @@
+# Gerador de bases sintéticas no formato dos arquivos do DNIT, para medir o
+# pipeline sem os dados reais: planilha de OAEs (Excel), shapefile do SNV
+# (ZIP), relatório do SGO (CSV ';' em latin1) e shapefile das UFs (ZIP).
+#
+# As UFs são um diagrama de Voronoi sobre o retângulo do Brasil; os segmentos
+# do SNV são polilinhas curtas, parte delas duplicadas com outra administração
+# (trechos coincidentes, que geram conflitos); as OAEs ficam sobre os
+# segmentos, com um pequeno deslocamento.
+#
+# Uso: python benchmarks/synthetic.py n_oae diretorio [--n-snv N] [--seed S]
+import argparse
+import io
+import os
+import tempfile
+import zipfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+SIGLAS_UF = [
+    'AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA',
+    'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO',
+]
+TIPOS_AD = [
+    'Federal', 'Estadual', 'Concessão Federal', 'Convênio Adm.Federal/Estadual',
+    'Municipal', 'Distrital', 'Convênio Adm.Federal/Municipal',
+]
+# Retângulo envolvente do Brasil, em graus (SIRGAS 2000)
+BBOX = (-74.0, -34.0, -34.8, 5.3)
+SOURCE_CRS = 4674
+
+# Nomes dos arquivos gerados, por chave de entrada do pipeline
+FILE_NAMES = {
+    'base_oae_colep': 'base_oae_colep.xlsx',
+    'SNV_202501A': 'SNV_202501A.zip',
+    '23012025_relatoriosEmLote': '23012025_relatoriosEmLote.csv',
+    'BR_UF_2022': 'BR_UF_2022.zip',
+}
+
+
+def default_n_snv(n_oae):
+    # Proporção aproximada da base real: alguns segmentos por OAE, com mínimo
+    # para que as bases pequenas ainda cubram o país
+    return max(n_oae // 2, 500)
+
+
+def synthetic_uf(rng):
+    xmin, ymin, xmax, ymax = BBOX
+    seeds = shapely.points(rng.uniform(xmin, xmax, len(SIGLAS_UF)), rng.uniform(ymin, ymax, len(SIGLAS_UF)))
+    extent = shapely.box(xmin, ymin, xmax, ymax)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    # Cada célula recebe a sigla da semente que ela contém
+    order = [int(np.flatnonzero(shapely.contains(cell, seeds))[0]) for cell in cells]
+    return gpd.GeoDataFrame({'SIGLA_UF': np.array(SIGLAS_UF)[order]}, geometry=cells, crs=SOURCE_CRS)
+
+
+def synthetic_snv(n_snv, df_uf, rng, coincident=0.1):
+    xmin, ymin, xmax, ymax = BBOX
+    n_base = max(int(n_snv / (1 + coincident)), 1)
+    n_vertices = 4
+    # Polilinhas de ~5 km: ponto inicial aleatório e passos curtos
+    start = np.column_stack([rng.uniform(xmin, xmax, n_base), rng.uniform(ymin, ymax, n_base)])
+    steps = rng.normal(0, 0.015, (n_base, n_vertices - 1, 2)) + rng.normal(0, 0.02, (n_base, 1, 2))
+    coords = np.concatenate([start[:, None, :], start[:, None, :] + np.cumsum(steps, axis=1)], axis=1)
+    geoms = shapely.linestrings(coords)
+
+    br = rng.integers(10, 500, n_base)
+    uf_idx = df_uf.sindex.nearest(shapely.points(start), return_all=False)[1]
+    df = pd.DataFrame({
+        'vl_br': br.astype(str),
+        'sg_uf': df_uf['SIGLA_UF'].to_numpy()[uf_idx],
+        'ds_coinc': '',
+        'ds_tipo_ad': rng.choice(TIPOS_AD, n_base, p=[0.6, 0.2, 0.1, 0.04, 0.03, 0.01, 0.02]),
+        'ds_jurisdi': rng.choice(['Federal', 'Estadual'], n_base, p=[0.8, 0.2]),
+        'ds_superfi': rng.choice(['PAV', 'DUP', 'EOP', 'LEN'], n_base),
+        'ul': [f'UL{k:02d}' for k in rng.integers(1, 80, n_base)],
+        'versao_snv': '202501A',
+    })
+
+    # Trechos coincidentes: mesma geometria com outra administração/jurisdição
+    n_coinc = n_snv - n_base
+    dup = rng.integers(0, n_base, n_coinc)
+    coinc = df.iloc[dup].reset_index(drop=True)
+    coinc['ds_tipo_ad'] = rng.choice(TIPOS_AD, n_coinc)
+    coinc['ds_jurisdi'] = rng.choice(['Federal', 'Estadual'], n_coinc)
+    coinc['ds_coinc'] = 'S'
+    df = pd.concat([df, coinc], ignore_index=True)
+    geoms = np.concatenate([geoms, geoms[dup]])
+
+    df.insert(0, 'vl_codigo', [f'{b:03d}B{u}{i:04d}' for i, (b, u) in enumerate(zip(df['vl_br'].astype(int), df['sg_uf']))])
+    return gpd.GeoDataFrame(df, geometry=geoms, crs=SOURCE_CRS)
+
+
+def synthetic_oae(n_oae, df_snv, rng):
+    seg = rng.integers(0, len(df_snv), n_oae)
+    # Ponto ao longo do segmento, deslocado até ~100 m
+    points = shapely.line_interpolate_point(np.asarray(df_snv.geometry.array)[seg], rng.uniform(0, 1, n_oae), normalized=True)
+    lon = shapely.get_x(points) + rng.normal(0, 0.0005, n_oae)
+    lat = shapely.get_y(points) + rng.normal(0, 0.0005, n_oae)
+    cod_sgo = rng.choice(np.arange(1, max(10 * n_oae, 999999)), n_oae, replace=False)
+    tipo_obra = rng.choice(['Ponte', 'Viaduto', 'Passarela', 'Túnel', ''], n_oae, p=[0.6, 0.25, 0.1, 0.03, 0.02])
+    df = pd.DataFrame({
+        'cod_sgo': cod_sgo,
+        'descr_obra': [f'{t or "Obra"} sobre o Rio {k}' for t, k in zip(tipo_obra, rng.integers(0, n_oae, n_oae))],
+        'br': df_snv['vl_br'].to_numpy()[seg].astype(int),
+        'uf': df_snv['sg_uf'].to_numpy()[seg],
+        'ul': df_snv['ul'].to_numpy()[seg],
+        'extens_m': rng.gamma(2, 30, n_oae).round(2),
+        'largura_m': rng.uniform(6, 25, n_oae).round(2),
+        'tipo_estrutura': rng.choice(['Concreto armado', 'Concreto protendido', 'Aço', 'Mista'], n_oae),
+        'tipo_obra': tipo_obra,
+        'origem_cadastro': rng.choice(['SGO', 'COLEP', 'Vistoria'], n_oae),
+        'latitude': lat.round(6),
+        'longitude': lon.round(6),
+    })
+    return df, seg
+
+
+def synthetic_sgo(df_oae, seg, df_snv, rng, missing=0.05):
+    # Relatório do SGO: uma linha por OAE (menos uma fração ausente), com o
+    # PNV do segmento de origem e, em parte dos casos, outro PNV qualquer
+    n = len(df_oae)
+    keep = rng.uniform(0, 1, n) >= missing
+    pnv = df_snv['vl_codigo'].to_numpy()[seg]
+    other = rng.uniform(0, 1, n) < 0.1
+    pnv[other] = df_snv['vl_codigo'].to_numpy()[rng.integers(0, len(df_snv), other.sum())]
+    return pd.DataFrame({
+        'Código': df_oae['cod_sgo'].astype(str),
+        'Nome': df_oae['descr_obra'],
+        'UF': df_oae['uf'],
+        'PNV': pnv,
+        'Nota': rng.choice(['1', '2', '3', '4', '5'], n),
+    })[keep]
+
+
+def zipped_shapefile(df, layer):
+    # Shapefile empacotado em ZIP (arquivos na raiz), como no upload do app
+    buffer = io.BytesIO()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        df.to_file(os.path.join(tmp_dir, f'{layer}.shp'), engine='pyogrio')
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name in sorted(os.listdir(tmp_dir)):
+                z.write(os.path.join(tmp_dir, name), name)
+    return buffer.getvalue()
+
+
+def generate(n_oae, output_dir, n_snv=None, seed=0):
+    # Grava os quatro arquivos em output_dir e devolve o dicionário de entradas
+    # do pipeline (chave -> caminho)
+    rng = np.random.default_rng(seed)
+    df_uf = synthetic_uf(rng)
+    df_snv = synthetic_snv(n_snv or default_n_snv(n_oae), df_uf, rng)
+    df_oae, seg = synthetic_oae(n_oae, df_snv, rng)
+    df_sgo = synthetic_sgo(df_oae, seg, df_snv, rng)
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {key: os.path.join(output_dir, name) for key, name in FILE_NAMES.items()}
+    df_oae.to_excel(paths['base_oae_colep'], index=False)
+    df_sgo.to_csv(paths['23012025_relatoriosEmLote'], sep=';', index=False, encoding='latin1')
+    with open(paths['SNV_202501A'], 'wb') as f:
+        f.write(zipped_shapefile(df_snv, 'SNV_202501A'))
+    with open(paths['BR_UF_2022'], 'wb') as f:
+        f.write(zipped_shapefile(df_uf, 'BR_UF_2022'))
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera bases sintéticas de OAE, SNV, SGO e UF.')
+    parser.add_argument('n_oae', type=int, help='Número de OAEs (1000 a 500000)')
+    parser.add_argument('output', help='Diretório de saída')
+    parser.add_argument('--n-snv', type=int, default=None, help='Número de segmentos do SNV (padrão: n_oae / 2)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for key, path in generate(args.n_oae, args.output, args.n_snv, args.seed).items():
+        print(f'{key}: {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)')
@@ -1,165 +1,986 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
+import pyproj
+import shapely
 import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+import pydeck as pdk
 import folium
 import streamlit as st
-from streamlit_folium import folium_static
+import streamlit.components.v1 as components
+from folium.plugins import FastMarkerCluster
+from streamlit_folium import st_folium
+from branca.element import Template
+import pipeline
+import snv_tiles
+from pipeline import CACHE_DIR, SNV_LOD_LEVELS, PipelineError
 from streamlit import set_page_config
 from streamlit_searchbox import st_searchbox
 import webbrowser
-import fiona
-import zipfile
-import io
-import tempfile
 import os
+import re
+import unicodedata
+import json
+import logging
+import threading
+from collections import OrderedDict
 
 # PARTE 1 - TRANSFORMAÇÃO DE DADOS E MAPA
+# O processamento das bases fica em pipeline.py (também executável em lote)
 
-@st.cache_data
+# Logs estruturados das etapas (ver pipeline.stage) na saída do servidor
+stage_log = logging.getLogger('mapa_oae')
+if not stage_log.handlers:
+    stage_log.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    stage_log.addHandler(handler)
+
+# Saída pré-processada pelo modo em lote (python pipeline.py ... --output DIR).
+# Quando definida, o app abre esse dataset sem exigir o upload dos arquivos.
+PRECOMPUTED_DIR = os.environ.get('MAPA_OAE_DATA_DIR')
+
+
+@st.cache_resource(max_entries=2)
+def get_spatial_index(index_key, _uploaded_files, cache_dir=CACHE_DIR):
+    # Memória do processo -> disco -> construção a partir dos shapefiles
+    return pipeline.get_spatial_index(index_key, _uploaded_files, cache_dir)
+
+
+# Dataset compartilhado: st.cache_resource guarda uma única cópia de df_snv e
+# df_oae por processo (até 2 datasets), usada por todas as sessões. Com
+# st.cache_data cada sessão recebia sua própria cópia (desserializada).
+# Os DataFrames são SOMENTE LEITURA: o app não altera colunas nem linhas; os
+# filtros produzem máscaras e posições de linhas (ver filtered_rows) e as
+# linhas só são copiadas para montar um mapa que não está em cache.
+#
+# Orçamento de memória por sessão (além do dataset compartilhado): as máscaras
+# dos filtros (1 byte por linha e filtro) e as posições selecionadas (8 bytes
+# por linha), descartadas a cada execução; ao montar um mapa fora do cache, as
+# linhas filtradas (no máximo o tamanho do dataset, liberadas ao fim da
+# execução). O HTML dos mapas fica num cache comum limitado por
+# MAPA_OAE_MAP_CACHE_MAX_BYTES. Ex.: 500 mil OAEs -> ~5 MB por execução, sem
+# contar o mapa.
+def prepare_dataset(df_snv, df_oae):
+    # Ajustes do app feitos uma vez por dataset: só os segmentos do SNV com
+    # cor no mapa (color_map), com ds_tipo_ad como texto
+    ds_tipo_ad = df_snv['ds_tipo_ad'].astype(str)
+    keep = ds_tipo_ad.isin(color_map.keys()).to_numpy()
+    df_snv = df_snv[keep].assign(ds_tipo_ad=ds_tipo_ad.to_numpy()[keep])
+    return df_snv, df_oae
+
+
+@st.cache_resource(max_entries=2)
 def load_data(uploaded_files):
-    # Verificar se todos os arquivos necessários foram carregados
-    required_files = ['base_oae_colep', 'SNV_202501A', '23012025_relatoriosEmLote', 'BR_UF_2022']
-    for file in required_files:
-        if file not in uploaded_files:
-            st.error(f"Arquivo obrigatório não encontrado: {file}")
-            st.stop()
-    
     try:
-        # 1. Carregando os dados dos arquivos enviados
-        v_oae_v2 = pd.read_excel(uploaded_files['base_oae_colep'])
-        
-        # Processar o shapefile SNV
-        with zipfile.ZipFile(uploaded_files['SNV_202501A'], 'r') as z:
-            # Encontrar o arquivo .shp dentro do ZIP
-            shp_file = [f for f in z.namelist() if f.endswith('.shp')][0]
-            # Extrair todos os arquivos para um diretório temporário
-            temp_dir = tempfile.mkdtemp()
-            z.extractall(temp_dir)
-            # Carregar o shapefile usando o caminho completo
-            v_snv_2025 = gpd.read_file(os.path.join(temp_dir, shp_file))
-        
-        # Carregar arquivo CSV
-        v_oae_sgo = pd.read_csv(uploaded_files['23012025_relatoriosEmLote'], 
-                               dtype=str, sep=';', encoding='latin1')
-        
-        # Processar o shapefile BR_UF
-        with zipfile.ZipFile(uploaded_files['BR_UF_2022'], 'r') as z:
-            # Encontrar o arquivo .shp dentro do ZIP
-            shp_file = [f for f in z.namelist() if f.endswith('.shp')][0]
-            # Extrair todos os arquivos para um diretório temporário
-            temp_dir = tempfile.mkdtemp()
-            z.extractall(temp_dir)
-            # Carregar o shapefile usando o caminho completo
-            v_uf = gpd.read_file(os.path.join(temp_dir, shp_file))
-
-        # Restante do processamento...
-        v_oae_v2['geometry'] = v_oae_v2.apply(lambda row: Point(row['longitude'], row['latitude']), axis=1)
-        v_oae_v2 = gpd.GeoDataFrame(v_oae_v2, geometry='geometry', crs=v_snv_2025.crs)
-        v_oae_v2 = v_oae_v2.to_crs(epsg=5880)
-        v_snv_2025 = v_snv_2025.to_crs(epsg=5880)
-        v_uf = v_uf.to_crs(epsg=5880)
-
-        colunas_snv = ['vl_codigo', 'ds_tipo_ad', 'ds_jurisdi','ul','versao_snv', 'geometry']
-
-        # 3. Spatial join com buffer de 250m (ST_DWithin)
-        df_merged = gpd.sjoin(v_oae_v2, v_snv_2025[colunas_snv], how="left", predicate='dwithin', distance=250, lsuffix='1', rsuffix='2')
-
-        df_merged = df_merged.drop(columns='index_2')
-        v_uf.rename(columns={
-            'SIGLA_UF': 'uf'
-        }, inplace=True)
-        v_uf = gpd.GeoDataFrame(v_uf, geometry='geometry')
-        df_merged = gpd.sjoin(df_merged, v_uf[['uf', 'geometry']], how="left", predicate='dwithin', distance=500, lsuffix='1', rsuffix='2')
-        del df_merged['index_2']
-        df_merged['cod_sgo'] = df_merged['cod_sgo'].astype(str).str.zfill(6)
-        df_merged['br'] = df_merged['br'].astype(str).str.zfill(3)
-
-        # 4. Agrupamento similar ao CTE1
-        agg_funcs = {
-            'descr_obra': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'br': lambda x: ';'.join(set(x.dropna().apply(lambda y: str(y).zfill(3)))),
-            'uf_1': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'ul_1': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'extens_m': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'largura_m': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'tipo_estrutura': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'tipo_obra': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'origem_cadastro': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'latitude': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'longitude': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'uf_2': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'vl_codigo': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'ds_tipo_ad': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'ds_jurisdi': lambda x: ';'.join(set(x.dropna().astype(str))),
-            'ul_2': lambda x: ';'.join(set(x.dropna().astype(str))),
+        return prepare_dataset(*pipeline.load_dataset(uploaded_files, spatial_index=get_spatial_index))
+
+    except PipelineError as e:
+        st.error(str(e))
+        st.stop()
+
+    except Exception as e:
+        st.error(f"Erro ao processar os arquivos: {str(e)}")
+        st.stop()
+
+
+def load_precomputed(output_dir):
+    # O dataset.json é lido a cada execução (fora do cache): quando o modo em
+    # lote grava uma nova saída, o subdiretório muda e o novo dataset é carregado
+    meta = pipeline.read_outputs_meta(output_dir)
+    if meta is None:
+        st.error(f"Dataset pré-processado não encontrado ou desatualizado em {output_dir}")
+        st.stop()
+    return load_precomputed_dataset(output_dir, meta['dataset_key'], meta.get('data_dir'))
+
+
+@st.cache_resource(max_entries=2)
+def load_precomputed_dataset(output_dir, dataset_key, data_dir):
+    data = pipeline.read_outputs(output_dir, {'dataset_key': dataset_key, 'data_dir': data_dir or ''})
+    if data is None:
+        st.error(f"Dataset pré-processado incompleto em {output_dir}")
+        st.stop()
+    return prepare_dataset(*data)
+
+
+@st.cache_resource(max_entries=2)
+def get_dataset_memory(dataset_key, _df_snv, _df_oae):
+    # Memória (MB) do dataset compartilhado, para o painel de diagnóstico
+    return sum(df.memory_usage(deep=True).sum() for df in (_df_snv, _df_oae)) / 1024 ** 2
+
+
+def filtered_rows(mask, n_rows):
+    # Posições das linhas selecionadas por uma máscara de facet_mask (None =
+    # todas), sem copiar o DataFrame
+    return np.arange(n_rows) if mask is None else np.flatnonzero(mask)
+
+
+# Definir listas para tooltips
+lista_snv = ['vl_br', 'sg_uf', 'vl_codigo', 'ds_coinc', 'ds_tipo_ad', 'ds_jurisdi','ds_superfi','ul']
+lista_oae = ['cod_sgo', 'descr_obra', 'tipo_obra','nota_sgo', 'origem_cadastro', 'uf_2', 'vl_codigo', 'ds_tipo_ad','ds_jurisdi', 'ul_2']
+
+# Mapeamento de cores
+color_map = {
+    'Convênio Adm.Federal/Estadual': 'cyan',
+    'Federal': 'red',
+    'Distrital': 'cyan',
+    'Estadual': 'cyan',
+    'Municipal': 'cyan',
+    'Concessão Federal': 'cyan',
+    'Convênio Adm.Federal/Municipal': 'cyan'
+}
+
+
+# Modos de renderização das OAEs no mapa
+OAE_RENDER_MODES = {
+    'Camada única (GeoJSON)': 'geojson',
+    'Agrupado (cluster)': 'cluster',
+    'Marcadores individuais': 'markers',
+}
+
+# Campos das OAEs enviados ao navegador; o popup é montado no cliente
+OAE_POPUP_FIELDS = ['cod_sgo', 'descr_obra', 'tipo_obra', 'nota_sgo', 'br', 'uf_2']
+OAE_MARKER_STYLE = {'radius': 4, 'color': 'black', 'fill': True, 'fillOpacity': 0.5}
+
+# Monta o HTML do popup a partir das propriedades da OAE (mesmo conteúdo do
+# popup dos marcadores individuais)
+OAE_POPUP_JS = """
+function (p) {
+    function esc(v) {
+        return String(v === null || v === undefined ? '' : v).replace(/[&<>"]/g, function (c) {
+            return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c];
+        });
+    }
+    return '<div style="font-family: Arial; font-size: 12px">' +
+        '<b>Código SGO:</b> ' + esc(p.cod_sgo) + '<br>' +
+        '<b>Descrição:</b> ' + esc(p.descr_obra) + '<br>' +
+        '<b>Tipo Obra:</b> ' + esc(p.tipo_obra) + '<br>' +
+        '<b>Nota SGO:</b> ' + esc(p.nota_sgo) + '<br>' +
+        '<b>BR:</b> ' + esc(p.br) + '<br>' +
+        '<b>UF:</b> ' + esc(p.uf_2) + '<br>' +
+        '<a href="https://www.google.com/maps?q=&layer=c&cbll=' + p.lat + ',' + p.lon + '" target="_blank" ' +
+        'style="color: blue; text-decoration: underline;">Abrir no Street View</a>' +
+        '</div>';
+}
+"""
+
+
+def oae_popup_records(filtered_oae):
+    # Coordenadas (EPSG:4326, 6 casas) e campos do popup de cada OAE com
+    # coordenadas válidas, já em tipos serializáveis em JSON
+    lat = filtered_oae['latitude'].round(6)
+    lon = filtered_oae['longitude'].round(6)
+    valid = (lat.notna() & lon.notna()).to_numpy()
+    fields = filtered_oae.loc[valid, OAE_POPUP_FIELDS].astype(object)
+    fields = fields.where(fields.notna(), None)
+    return lat[valid].tolist(), lon[valid].tolist(), fields.to_dict('records')
+
+
+class OaeGeoJson(folium.map.Layer):
+    # Todas as OAEs numa única camada L.geoJson: um círculo por feição, com
+    # estilo e popup aplicados no navegador a partir das propriedades
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }}_popup = {{ this.popup_js }};
+        var {{ this.get_name() }} = L.geoJson({{ this.data }}, {
+            pointToLayer: function (feature, latlng) {
+                return L.circleMarker(latlng, {{ this.marker_style|tojson }});
+            },
+            onEachFeature: function (feature, layer) {
+                layer.bindPopup(function () {
+                    return {{ this.get_name() }}_popup(feature.properties);
+                }, {maxWidth: 250});
+            }
+        });
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, data, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'OaeGeoJson'
+        # JSON compacto; '</' escapado para não fechar a tag <script>
+        self.data = json.dumps(data, separators=(',', ':'), ensure_ascii=False).replace('</', '<\\/')
+        self.marker_style = OAE_MARKER_STYLE
+        self.popup_js = OAE_POPUP_JS
+
+
+def add_oae_geojson(m, filtered_oae):
+    lat, lon, records = oae_popup_records(filtered_oae)
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [x, y]},
+            'properties': dict(props, lat=y, lon=x),
         }
+        for y, x, props in zip(lat, lon, records)
+    ]
+    OaeGeoJson({'type': 'FeatureCollection', 'features': features}, name='OAE').add_to(m)
 
-        df_grouped = df_merged.groupby(['cod_sgo', 'geometry']).agg(agg_funcs).reset_index()
 
-        # 5. Join com v_oae_sgo
-        v_oae_sgo['Código'] = v_oae_sgo['Código'].astype(str).str.zfill(6)
-        df_grouped['cod_sgo'] = df_grouped['cod_sgo'].astype(str).str.zfill(6)
+def add_oae_cluster(m, filtered_oae):
+    # Mesmo popup, com os pontos enviados como linhas compactas e agrupados
+    # pelo Leaflet.markercluster
+    lat, lon, records = oae_popup_records(filtered_oae)
+    data = [[y, x] + [props[f] for f in OAE_POPUP_FIELDS] for y, x, props in zip(lat, lon, records)]
+    fields = ', '.join(f"{f}: row[{i + 2}]" for i, f in enumerate(OAE_POPUP_FIELDS))
+    callback = f"""
+    (function () {{
+        var popup = {OAE_POPUP_JS};
+        return function (row) {{
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {json.dumps(OAE_MARKER_STYLE)});
+            var props = {{lat: row[0], lon: row[1], {fields}}};
+            marker.bindPopup(function () {{ return popup(props); }}, {{maxWidth: 250}});
+            return marker;
+        }};
+    }})()"""
+    FastMarkerCluster(data, callback=callback, name='OAE').add_to(m)
+
+
+def add_oae_markers(m, filtered_oae):
+    # Um CircleMarker com popup em IFrame por OAE (modo original)
+    for _, row in filtered_oae.iterrows():
+        # Criar conteúdo HTML para o tooltip
+        html = f"""
+        <div style="font-family: Arial; font-size: 12px">
+            <b>Código SGO:</b> {row['cod_sgo']}<br>
+            <b>Descrição:</b> {row['descr_obra']}<br>
+            <b>Tipo Obra:</b> {row['tipo_obra']}<br>
+            <b>Nota SGO:</b> {row['nota_sgo']}<br>
+            <b>BR:</b> {row['br']}<br>
+            <b>UF:</b> {row['uf_2']}<br>
+            <a href="{row['streetview_link']}" target="_blank" style="color: blue; text-decoration: underline;">
+                Abrir no Street View
+            </a>
+        </div>
+        """
+
+        iframe = folium.IFrame(html, width=250, height=150)
+        popup = folium.Popup(iframe, max_width=250)
+
+        folium.CircleMarker(
+            location=[row['latitude'], row['longitude']],
+            radius=4,
+            color='black',
+            fill=True,
+            fill_opacity=0.5,
+            popup=popup
+        ).add_to(m)
+
+
+# Usa o nível mais grosseiro cuja tolerância não passe de extensão / SNV_LOD_RESOLUTION
+# (≈ 1400 px de largura do mapa com folga para ~3x de zoom no navegador)
+SNV_LOD_RESOLUTION = 4000
+
+
+def select_snv_lod(filtered_snv, extent=None, pixel_size=None):
+    # Escolhe o nível de detalhe pelo tamanho do pixel em metros: o do zoom
+    # da vista (`pixel_size`) ou, sem ele, a extensão da seleção (maior lado
+    # do retângulo envolvente, ou `extent` em metros) / SNV_LOD_RESOLUTION.
+    # Devolve só as colunas exibidas no mapa, com a geometria escolhida como
+    # 'geometry'.
+    if pixel_size is None:
+        if extent is None:
+            xmin, ymin, xmax, ymax = filtered_snv.total_bounds
+            extent = max(xmax - xmin, ymax - ymin) if len(filtered_snv) else 0
+        pixel_size = extent / SNV_LOD_RESOLUTION
+    column = SNV_LOD_LEVELS[0][1]
+    for tolerance, level_column in SNV_LOD_LEVELS:
+        if level_column in filtered_snv.columns and tolerance <= pixel_size:
+            column = level_column
+    columns = list(dict.fromkeys(lista_snv + ['ds_tipo_ad']))
+    snv = gpd.GeoDataFrame(filtered_snv[columns], geometry=filtered_snv[column].values, crs=filtered_snv.crs)
+    return snv
 
-        df_merged = pd.merge(df_grouped, v_oae_sgo[['Código', 'PNV','Nota']], left_on='cod_sgo', right_on='Código', how='left')
-        df_merged = df_merged.rename(columns={'Nota': 'nota_sgo', 'PNV': 'sgo_pnv'})
-        del df_merged['Código']
-        
-        # 6. Calculando conflitos
-        df_merged['conflitos'] = df_merged.apply(
-            lambda row: 'Sim' if any(';' in str(row[col]) for col in ['ds_tipo_ad', 'ds_jurisdi', 'ul_2', 'uf_2']) else 'Não',
-            axis=1
-        )
-        df_merged.rename(columns={
-            'uf_1': 'uf',
-            'ul_1': 'ul' 
-            }, inplace=True)
-
-        # 7. Join df_final com v_snv_2025 novamente para trazer campos do PNV
-        df_final = pd.merge(df_merged, v_snv_2025[['vl_codigo', 'ds_tipo_ad', 'ds_jurisdi', 'ul']], left_on='sgo_pnv', right_on='vl_codigo', how='left', suffixes=('','_pnv'))
-        df_final = gpd.GeoDataFrame(df_final, geometry='geometry')
-        df_oae = df_final.copy()
-        df_snv = v_snv_2025.copy()
-        
-        # Simplificar geometria
-        df_snv['geometry'] = df_snv['geometry'].simplify(tolerance=10, preserve_topology=True)
-
-        # Criação da coluna tipo_conflito
-        df_oae.loc[df_oae['uf_2'].str.contains(';', case=False, na=False), 'conflito_divisa'] = 'Divisa'
-        df_oae.loc[df_oae['ds_tipo_ad'].str.contains(';', case=False, na=False), 'conflito_administracao'] = 'Administração'
-        df_oae.loc[df_oae['ds_jurisdi'].str.contains(';', case=False, na=False), 'conflito_jurisdicao'] = 'Jurisdição'
-        df_oae.loc[df_oae['ul_2'].str.contains(';', case=False, na=False), 'conflito_unidade_local'] = 'UnidadeLocal'
-
-        # Concatenação da coluna tipo_conflito
-        df_oae['tipo_conflito'] = df_oae[
-            ['conflito_divisa', 'conflito_administracao', 'conflito_jurisdicao', 'conflito_unidade_local']
-        ].apply(lambda row: '; '.join(row.dropna()), axis=1)
-
-        df_oae.drop(
-            columns=['conflito_divisa', 'conflito_administracao', 'conflito_jurisdicao', 'conflito_unidade_local'],
-            inplace=True
-        )
 
-        df_oae['tipo_conflito'] = df_oae['tipo_conflito'].replace('', None)
+# Servidor local de vector tiles do SNV (ver snv_tiles.py). O servidor escuta
+# em MAPA_OAE_TILE_HOST:MAPA_OAE_TILE_PORT e os navegadores o acessam por
+# MAPA_OAE_TILE_URL, o endereço publicado (p.ex. um caminho do mesmo domínio
+# do app no proxy reverso, evitando conteúdo misto em HTTPS). Sem
+# MAPA_OAE_TILE_URL o modo de tiles não é oferecido: um endereço local só
+# funcionaria para navegadores na própria máquina do servidor.
+TILE_SERVER_HOST = os.environ.get('MAPA_OAE_TILE_HOST', '127.0.0.1')
+TILE_SERVER_PORT = int(os.environ.get('MAPA_OAE_TILE_PORT', 8765))
+TILE_SERVER_URL = os.environ.get('MAPA_OAE_TILE_URL')
 
-        # Substituição de valores vazios ou sem preenchimento
-        df_oae['nota_sgo'] = df_oae['nota_sgo'].fillna('Sem nota')
-        df_oae['tipo_obra'] = df_oae['tipo_obra'].replace('', '-')
-        df_oae['ds_tipo_ad'] = df_oae['ds_tipo_ad'].replace('', None)
+# Modos de exibição do SNV no mapa
+SNV_RENDER_MODES = {
+    'GeoJSON (embutido na página)': 'geojson',
+}
+if TILE_SERVER_URL:
+    SNV_RENDER_MODES['Vector tiles (servidor local)'] = 'tiles'
 
-        # Criação da Coluna 'streetview_link'
-        df_oae['latitude'] = df_oae['latitude'].str.split(';').str[0]
-        df_oae['longitude'] = df_oae['longitude'].str.split(';').str[0]
-        df_oae['streetview_link'] = df_oae.apply(
-            lambda row: f"https://www.google.com/maps?q=&layer=c&cbll={row['latitude']},{row['longitude']}", 
-            axis=1
+
+@st.cache_resource
+def get_tile_server():
+    # Um servidor por processo, servindo todos os MBTiles do diretório de
+    # cache. Se a porta não abrir, o OSError sobe e não fica no cache: a
+    # próxima execução tenta de novo (ver get_snv_tiles).
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    snv_tiles.start_tile_server(CACHE_DIR, TILE_SERVER_HOST, TILE_SERVER_PORT)
+    return TILE_SERVER_URL.rstrip('/')
+
+
+@st.cache_resource(max_entries=2)
+def build_snv_tiles(path, _df_snv):
+    # Gera o MBTiles do SNV em `path` (uma vez por diretório; ver get_snv_tiles)
+    os.makedirs(path, exist_ok=True)
+    snv_tiles.build_mbtiles(
+        [(tolerance, _df_snv[column]) for tolerance, column in SNV_LOD_LEVELS],
+        _df_snv[list(dict.fromkeys(lista_snv + ['ds_tipo_ad']))],
+        os.path.join(path, 'snv.mbtiles'),
+    )
+    return path
+
+
+def get_snv_tiles(dataset_key, df_snv, cache_dir=CACHE_DIR):
+    # Modelo de URL dos tiles do SNV em <cache>/tiles-<chave>/, ou None se o
+    # servidor não estiver disponível. A existência do MBTiles é conferida a
+    # cada chamada: a limpeza do cache (evict_cache) pode removê-lo.
+    try:
+        server_url = get_tile_server()
+    except OSError as e:
+        stage_log.error('Servidor de tiles indisponível em %s:%s: %s', TILE_SERVER_HOST, TILE_SERVER_PORT, e)
+        return None
+    path = os.path.join(cache_dir, f'tiles-{dataset_key}')
+    if not os.path.exists(os.path.join(path, 'snv.mbtiles')):
+        build_snv_tiles.clear()
+        build_snv_tiles(path, df_snv)
+    # mtime atualizado: a limpeza remove primeiro os menos usados
+    os.utime(path)
+    return f"{server_url}/{dataset_key}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+class SnvVectorGrid(folium.map.Layer):
+    # Camada Leaflet.VectorGrid com os tiles MVT do SNV: cor por ds_tipo_ad
+    # (color_map), popup com os campos de lista_snv e filtros da barra lateral
+    # aplicados no navegador (feições fora do filtro ficam invisíveis)
+    default_js = [
+        ('leaflet_vectorgrid', 'https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.min.js'),
+    ]
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        // Leaflet >= 1.8 removeu L.DomEvent.fakeStop, ainda usado pelo VectorGrid 1.3
+        if (!L.DomEvent.fakeStop) { L.DomEvent.fakeStop = function () { return true; }; }
+        var {{ this.get_name() }}_colors = {{ this.colors|tojson }};
+        var {{ this.get_name() }}_filters = {{ this.filters|tojson }};
+        var {{ this.get_name() }}_fields = {{ this.fields|tojson }};
+        var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+            rendererFactory: L.canvas.tile,
+            interactive: true,
+            maxNativeZoom: {{ this.max_native_zoom }},
+            vectorTileLayerStyles: {
+                snv: function (p, zoom) {
+                    var visible = {{ this.get_name() }}_filters.every(function (f) {
+                        return String(p[f[0]]).padStart(f[2], '0') === f[1];
+                    });
+                    if (!visible) { return {weight: 0, opacity: 0}; }
+                    return {weight: 2, opacity: 1, color: {{ this.get_name() }}_colors[p.ds_tipo_ad] || 'gray'};
+                }
+            }
+        }).on('click', function (e) {
+            var p = e.layer.properties;
+            var html = {{ this.get_name() }}_fields.map(function (f) {
+                return '<b>' + f + ':</b> ' + (p[f] === undefined ? '' : p[f]);
+            }).join('<br>');
+            L.popup().setLatLng(e.latlng).setContent(html).openOn({{ this._parent.get_name() }});
+        });
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, filters=None, name=None, max_native_zoom=12, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'SnvVectorGrid'
+        self.url = url
+        self.filters = filters or []
+        self.colors = color_map
+        self.fields = lista_snv
+        self.max_native_zoom = max_native_zoom
+
+
+# Colunas indexadas para os filtros da barra lateral. Os valores de BR são
+# comparados com zfill(3), como no filtro original.
+OAE_FACETS = ['uf', 'conflitos', 'tipo_conflito', 'ds_tipo_ad', 'br', 'tipo_obra', 'nota_sgo']
+SNV_FACETS = ['sg_uf', 'ds_tipo_ad', 'vl_br']
+
+
+def build_facets(df, columns):
+    # Para cada coluna: códigos inteiros (factorize ordenado, -1 para nulos) e
+    # rótulos. Opções e máscaras dos filtros saem só desses arrays.
+    facets = {}
+    for col in columns:
+        values = df[col]
+        if col in ('br', 'vl_br'):
+            values = values.where(values.isna(), values.astype(str).str.zfill(3))
+        elif col == 'nota_sgo':
+            values = values.where(values.isna(), values.astype(str))
+        codes, labels = pd.factorize(values, sort=True)
+        facets[col] = (codes.astype(np.int32), np.asarray(labels, dtype=object))
+    return facets
+
+
+def facet_mask(facets, col, value, mask=None):
+    # Intersecta `mask` com as linhas onde col == value; 'Todos' (ou None)
+    # mantém a máscara. None significa "todas as linhas".
+    if value is None or value == 'Todos':
+        return mask
+    codes, labels = facets[col]
+    pos = np.searchsorted(labels, value) if len(labels) else 0
+    if pos < len(labels) and labels[pos] == value:
+        value_mask = codes == pos
+    else:
+        value_mask = np.zeros(len(codes), dtype=bool)
+    return value_mask if mask is None else mask & value_mask
+
+
+def facet_options(facets, col, mask=None):
+    # Valores distintos (ordenados, sem nulos) de col nas linhas de mask
+    codes, labels = facets[col]
+    if mask is not None:
+        codes = codes[mask]
+    present = np.bincount(codes[codes >= 0], minlength=len(labels)) > 0
+    return labels[present].tolist()
+
+
+@st.cache_resource(max_entries=2)
+def get_facet_index(dataset_key, _df_oae, _df_snv):
+    # Construído uma vez por dataset e compartilhado entre sessões (somente leitura)
+    return {'oae': build_facets(_df_oae, OAE_FACETS), 'snv': build_facets(_df_snv, SNV_FACETS)}
+
+
+# Número máximo de sugestões devolvidas pela busca de OAE
+SEARCH_MAX_RESULTS = 50
+
+
+def normalize_text(text):
+    # Minúsculas e sem acentos ("Ponte São João" -> "ponte sao joao")
+    text = unicodedata.normalize('NFKD', str(text).casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def build_search_index(df):
+    # Índice de busca das OAEs, uma entrada por rótulo "código - descrição":
+    #   - códigos normalizados ordenados (busca por prefixo com searchsorted)
+    #   - palavras das descrições ordenadas (busca por início de palavra)
+    #   - índice de trigramas do texto "código - descrição - código", que
+    #     cobre as buscas por trecho em qualquer um dos formatos
+    df = df.dropna(subset=['cod_sgo', 'descr_obra'])
+    codes = df['cod_sgo'].astype(str).to_numpy()
+    descrs = df['descr_obra'].astype(str).to_numpy()
+    labels = pd.Series(codes + ' - ' + descrs, dtype=object)
+    first = labels.drop_duplicates().index.to_numpy()
+    labels, codes, descrs = labels.to_numpy()[first], codes[first], descrs[first]
+
+    norm_codes = np.array([normalize_text(c) for c in codes], dtype=str)
+    norm_descrs = [normalize_text(d) for d in descrs]
+    texts = [f"{c} - {d} - {c}" for c, d in zip(norm_codes, norm_descrs)]
+
+    code_order = np.argsort(norm_codes, kind='stable')
+    words, word_rows = [], []
+    trigrams = {}
+    for row, (descr, text) in enumerate(zip(norm_descrs, texts)):
+        for word in set(re.findall(r'\w+', descr)):
+            words.append(word)
+            word_rows.append(row)
+        for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            trigrams.setdefault(gram, []).append(row)
+    words = np.array(words, dtype=str)
+    word_order = np.argsort(words, kind='stable')
+
+    return {
+        'labels': labels,
+        'codes': codes,
+        'texts': texts,
+        'norm_descrs': norm_descrs,
+        'code_sorted': norm_codes[code_order],
+        'code_rows': code_order,
+        'word_sorted': words[word_order],
+        'word_rows': np.asarray(word_rows, dtype=np.int64)[word_order],
+        'trigrams': {gram: np.asarray(rows, dtype=np.int64) for gram, rows in trigrams.items()},
+    }
+
+
+def prefix_rows(sorted_values, rows, prefix):
+    # Linhas cujo valor (array ordenado) começa com `prefix`
+    start = np.searchsorted(sorted_values, prefix, side='left')
+    end = np.searchsorted(sorted_values, prefix + '\U0010ffff', side='left')
+    return rows[start:end]
+
+
+def ranked_search_rows(query, index):
+    # Gera as linhas candidatas em ordem de relevância: código exato, prefixo
+    # do código, início de palavra da descrição e, por fim, trecho em qualquer
+    # posição (consultas com 3+ caracteres). A geração é preguiçosa: quem
+    # consome para assim que tiver sugestões suficientes.
+    code_sorted = index['code_sorted']
+    yield from index['code_rows'][np.searchsorted(code_sorted, query, 'left'):np.searchsorted(code_sorted, query, 'right')]
+    yield from prefix_rows(code_sorted, index['code_rows'], query)
+    if ' ' not in query:
+        # Ordem das palavras: a palavra exata vem antes das mais longas
+        yield from prefix_rows(index['word_sorted'], index['word_rows'], query)
+    texts, descrs = index['texts'], index['norm_descrs']
+    if len(query) < 3:
+        # Consultas curtas demais para os trigramas: varredura direta, que
+        # termina cedo porque trechos curtos são comuns
+        yield from (r for r, text in enumerate(texts) if query in text)
+        return
+
+    # Trechos: percorre a menor lista de postagens entre os trigramas da
+    # consulta e confirma cada candidato no texto completo
+    grams = [query[i:i + 3] for i in range(len(query) - 2)]
+    postings = [index['trigrams'].get(gram) for gram in grams]
+    if any(rows is None for rows in postings):
+        return
+    candidates = min(postings, key=len)
+    if ' ' in query:
+        # Consultas com espaço: trechos no início de palavra vêm antes
+        word_start = f' {query}'
+        yield from (r for r in candidates if descrs[r].startswith(query) or word_start in descrs[r])
+    yield from (r for r in candidates if query in texts[r])
+
+
+def search_oae(searchterm: str, index: dict, limit: int = SEARCH_MAX_RESULTS) -> list[tuple[str, str]]:
+    # Sugestões (rótulo "código - descrição", código), sem acentos e sem
+    # diferenciar maiúsculas, limitadas a `limit` e ordenadas por relevância
+    query = normalize_text(searchterm or '').strip()
+    if not query:
+        return []
+
+    seen = set()
+    suggestions = []
+    for row in ranked_search_rows(query, index):
+        if row in seen:
+            continue
+        seen.add(row)
+        suggestions.append((index['labels'][row], index['codes'][row]))
+        if len(suggestions) >= limit:
+            break
+    return suggestions
+
+
+@st.cache_resource(max_entries=2)
+def get_search_index(dataset_key, _df_oae):
+    return build_search_index(_df_oae)
+
+
+# Função para criar o mapa
+def create_map(filtered_snv, filtered_oae, selected_point=None, oae_mode='geojson', snv_tiles_url=None, snv_filters=None):
+    if snv_tiles_url:
+        # SNV servido como vector tiles: a página só leva a URL e os filtros
+        m = folium.Map(tiles="OpenStreetMap")
+        bounds_source = filtered_snv if not filtered_snv.empty else filtered_oae
+        if len(bounds_source) and bounds_source.crs is not None:
+            xmin, ymin, xmax, ymax = bounds_source.to_crs(epsg=4326).total_bounds
+            m.fit_bounds([[ymin, xmin], [ymax, xmax]])
+        SnvVectorGrid(snv_tiles_url, filters=snv_filters, name="Rodovias(SNV)").add_to(m)
+    else:
+        m = select_snv_lod(filtered_snv).explore(
+            column='ds_tipo_ad',
+            cmap=list(color_map.values()),
+            categories=list(color_map.keys()),
+            style_kwds={"fillOpacity": 0.1},
+            tooltip=lista_snv,
+            categorical=True,
+            name="Rodovias(SNV)",
+            tiles="OpenStreetMap"
         )
 
-        return df_snv, df_oae
-    
-    except Exception as e:
-        st.error(f"Erro ao processar os arquivos: {str(e)}")
-        st.stop()
+    # Adicione este bloco para marcar o ponto selecionado
+    if selected_point is not None:
+        folium.Marker(
+            location=[selected_point['latitude'], selected_point['longitude']],
+            popup=f"OAE: {selected_point['cod_sgo']}",
+            icon=folium.Icon(color='red', icon='info-sign')
+        ).add_to(m)
+
+    # Adicionar pontos OAE (ver OAE_RENDER_MODES)
+    if oae_mode == 'geojson':
+        add_oae_geojson(m, filtered_oae)
+    elif oae_mode == 'cluster':
+        add_oae_cluster(m, filtered_oae)
+    else:
+        add_oae_markers(m, filtered_oae)
+
+    add_base_layers(m)
+    return m
+
+
+def add_base_layers(m):
+    # Adicionar diferentes tipos de mapas base
+    folium.TileLayer('OpenStreetMap', name='Rodovias').add_to(m)
+    folium.TileLayer('CartoDB.Positron', name='Light Mode').add_to(m)
+    folium.TileLayer('CartoDB.DarkMatter', name='Dark Mode').add_to(m)
+    folium.TileLayer(
+        tiles='https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+        attr='Google',
+        name='Satélite (Google)',
+        max_zoom=20
+    ).add_to(m)
+
+    folium.LayerControl().add_to(m)
+
+
+# Cache LRU do HTML do mapa já renderizado, compartilhado entre as sessões.
+# A chave é o estado dos filtros + ponto selecionado + hash do dataset; o
+# limite é pelo total de bytes do HTML guardado.
+MAP_HTML_CACHE_MAX_BYTES = int(os.environ.get('MAPA_OAE_MAP_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+MAP_WIDTH, MAP_HEIGHT = 1400, 800
+
+
+class MapHtmlCache:
+    def __init__(self, max_bytes=MAP_HTML_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        size = len(html.encode('utf-8'))
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key).encode('utf-8'))
+            if size > self.max_bytes:
+                # Mapa maior que o cache inteiro: não guarda
+                return
+            self.entries[key] = html
+            self.total_bytes += size
+            # Remove os menos usados até caber no limite
+            while self.total_bytes > self.max_bytes:
+                _, old_html = self.entries.popitem(last=False)
+                self.total_bytes -= len(old_html.encode('utf-8'))
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+@st.cache_resource
+def get_map_html_cache():
+    return MapHtmlCache()
+
+
+def render_map_html(m):
+    # Mesmo HTML que o folium_static geraria para o mapa
+    fig = folium.Figure().add_child(m)
+    return fig.render()
+
+# Modo "área visível": o mapa (st_folium) devolve os limites e o zoom da vista
+# e só as OAEs e os segmentos do SNV dentro dela são enviados, numa camada
+# trocada a cada movimento sem recarregar o mapa. Acima dos limites abaixo, as
+# OAEs são agrupadas numa grade sobre a vista e o SNV mostra só os segmentos
+# mais longos. A consulta ao SNV é limitada ao retângulo (em graus) coberto
+# pelo próprio SNV: vistas de zoom mundial, reprojetadas inteiras para o CRS
+# métrico, dão a volta e cortam parte da malha.
+VIEWPORT_MAX_OAE = int(os.environ.get('MAPA_OAE_VIEWPORT_MAX_OAE', 2000))
+VIEWPORT_MAX_SNV = int(os.environ.get('MAPA_OAE_VIEWPORT_MAX_SNV', 3000))
+VIEWPORT_CLUSTER_CELLS = 40
+# A partir deste zoom as OAEs da vista aparecem sempre uma a uma (a vista tem
+# poucos quilômetros de lado)
+VIEWPORT_POINTS_ZOOM = 13
+
+
+@st.cache_resource(max_entries=2)
+def get_viewport_index(dataset_key, _df_oae, _df_snv):
+    # STRtree das OAEs (lon/lat, só as com coordenadas) e do SNV (CRS métrico),
+    # construídas uma vez por dataset e compartilhadas entre sessões
+    lonlat = np.column_stack([_df_oae['longitude'].to_numpy(dtype=float), _df_oae['latitude'].to_numpy(dtype=float)])
+    oae_rows = np.flatnonzero(np.isfinite(lonlat).all(axis=1))
+    snv_geoms = np.asarray(_df_snv.geometry.array)
+    snv_bounds = shapely.bounds(snv_geoms)
+    to_wgs84 = pyproj.Transformer.from_crs(_df_snv.crs, 4326, always_xy=True)
+    finite = snv_bounds[np.isfinite(snv_bounds).all(axis=1)]
+    snv_lonlat_box = None
+    if len(finite):
+        snv_lonlat_box = to_wgs84.transform_bounds(*finite[:, :2].min(axis=0), *finite[:, 2:].max(axis=0))
+    return {
+        'oae_tree': shapely.STRtree(shapely.points(lonlat[oae_rows])),
+        'oae_rows': oae_rows,
+        'oae_lonlat': lonlat,
+        'snv_tree': shapely.STRtree(snv_geoms),
+        'snv_bounds': snv_bounds,
+        'snv_lonlat_box': snv_lonlat_box,
+        'snv_length': shapely.length(snv_geoms),
+        'to_snv_crs': pyproj.Transformer.from_crs(4326, _df_snv.crs, always_xy=True),
+        'to_wgs84': to_wgs84,
+    }
+
+
+def viewport_bounds(state_bounds):
+    # Limites devolvidos pelo st_folium -> ((sul, oeste), (norte, leste))
+    try:
+        south_west, north_east = state_bounds['_southWest'], state_bounds['_northEast']
+        bounds = ((south_west['lat'], south_west['lng']), (north_east['lat'], north_east['lng']))
+    except (KeyError, TypeError):
+        return None
+    if any(v is None for corner in bounds for v in corner):
+        return None
+    return bounds
+
+
+def data_bounds(index, snv_rows, oae_rows):
+    # Retângulo (em graus) das linhas selecionadas: vista inicial do mapa.
+    # Usa os retângulos guardados no índice, sem reprojetar geometrias.
+    boxes = []
+    snv_bounds = index['snv_bounds'][snv_rows]
+    snv_bounds = snv_bounds[np.isfinite(snv_bounds).all(axis=1)]
+    if len(snv_bounds):
+        xmin, ymin = snv_bounds[:, :2].min(axis=0)
+        xmax, ymax = snv_bounds[:, 2:].max(axis=0)
+        west, south, east, north = index['to_wgs84'].transform_bounds(xmin, ymin, xmax, ymax)
+        boxes.append((south, west, north, east))
+    lonlat = index['oae_lonlat'][oae_rows]
+    lonlat = lonlat[np.isfinite(lonlat).all(axis=1)]
+    if len(lonlat):
+        (west, south), (east, north) = lonlat.min(axis=0), lonlat.max(axis=0)
+        boxes.append((south, west, north, east))
+    if not boxes:
+        return None
+    boxes = np.array(boxes, dtype=float)
+    return ((boxes[:, 0].min(), boxes[:, 1].min()), (boxes[:, 2].max(), boxes[:, 3].max()))
+
+
+def query_viewport(index, bounds, oae_mask=None, snv_mask=None, max_snv=VIEWPORT_MAX_SNV):
+    # Posições (em df_oae / df_snv, ordenadas) das OAEs e segmentos dentro da
+    # vista que passam nos filtros, o total de segmentos antes do corte pelos
+    # max_snv mais longos e a extensão da vista em metros
+    (south, west), (north, east) = bounds
+    oae_rows = index['oae_rows'][index['oae_tree'].query(shapely.box(west, south, east, north))]
+    oae_rows.sort()
+    if oae_mask is not None:
+        oae_rows = oae_rows[oae_mask[oae_rows]]
+
+    snv_rows, extent = np.empty(0, dtype=np.intp), 0.0
+    if index['snv_lonlat_box'] is not None:
+        box_west, box_south, box_east, box_north = index['snv_lonlat_box']
+        west, south = max(west, box_west), max(south, box_south)
+        east, north = min(east, box_east), min(north, box_north)
+    if index['snv_lonlat_box'] is not None and west <= east and south <= north:
+        xmin, ymin, xmax, ymax = index['to_snv_crs'].transform_bounds(west, south, east, north)
+        snv_rows = np.sort(index['snv_tree'].query(shapely.box(xmin, ymin, xmax, ymax)))
+        extent = max(xmax - xmin, ymax - ymin)
+    if snv_mask is not None:
+        snv_rows = snv_rows[snv_mask[snv_rows]]
+    snv_total = len(snv_rows)
+    if snv_total > max_snv:
+        longest = np.argsort(-index['snv_length'][snv_rows], kind='stable')[:max_snv]
+        snv_rows = np.sort(snv_rows[longest])
+    return oae_rows, snv_rows, snv_total, extent
+
+
+def viewport_pixel_size(bounds, zoom):
+    # Metros por pixel no centro da vista (Web Mercator, tiles de 256 px)
+    (south, _), (north, _) = bounds
+    return 156543.03392 * np.cos(np.radians((south + north) / 2)) / 2 ** zoom
+
+
+def cluster_oae(lat, lon, bounds, cells=VIEWPORT_CLUSTER_CELLS):
+    # Agrupa os pontos numa grade cells x cells sobre a vista: centro médio e
+    # número de OAEs de cada célula ocupada
+    (south, west), (north, east) = bounds
+    ix = np.clip(((lon - west) / max(east - west, 1e-9) * cells).astype(np.int64), 0, cells - 1)
+    iy = np.clip(((lat - south) / max(north - south, 1e-9) * cells).astype(np.int64), 0, cells - 1)
+    _, inverse = np.unique(iy * cells + ix, return_inverse=True)
+    counts = np.bincount(inverse)
+    return np.bincount(inverse, lat) / counts, np.bincount(inverse, lon) / counts, counts
+
+
+def create_viewport_layers(view_snv, view_oae, bounds, extent, selected_point=None, max_oae=VIEWPORT_MAX_OAE,
+                           zoom=None):
+    # Camada com o conteúdo da vista, enviada ao mapa já montado
+    # (feature_group_to_add do st_folium). Com o zoom do mapa, o nível de
+    # detalhe do SNV segue o tamanho do pixel e as OAEs não são agrupadas a
+    # partir de VIEWPORT_POINTS_ZOOM; sem ele (vista inicial), vale `extent`.
+    group = folium.FeatureGroup(name='Área visível')
+    pixel_size = viewport_pixel_size(bounds, zoom) if zoom is not None else None
+    if len(view_snv):
+        snv = select_snv_lod(view_snv, extent=extent, pixel_size=pixel_size).to_crs(epsg=4326)
+        snv[lista_snv] = snv[lista_snv].astype(object).where(snv[lista_snv].notna(), None)
+        folium.GeoJson(
+            snv,
+            name='Rodovias(SNV)',
+            style_function=lambda feature: {
+                'color': color_map.get(feature['properties']['ds_tipo_ad'], 'gray'),
+                'weight': 2,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=lista_snv),
+        ).add_to(group)
+
+    clustered = len(view_oae) > max_oae and (zoom is None or zoom < VIEWPORT_POINTS_ZOOM)
+    if clustered:
+        lat, lon, counts = cluster_oae(view_oae['latitude'].to_numpy(dtype=float),
+                                       view_oae['longitude'].to_numpy(dtype=float), bounds)
+        for y, x, count in zip(lat, lon, counts):
+            folium.CircleMarker(
+                location=[y, x],
+                radius=float(4 + 3 * np.log2(count)),
+                color='black',
+                weight=1,
+                fill=True,
+                fill_opacity=0.5,
+                tooltip=f"{count} OAEs (aproxime para ver)",
+            ).add_to(group)
+    elif len(view_oae):
+        add_oae_geojson(group, view_oae)
+
+    if selected_point is not None:
+        folium.Marker(
+            location=[selected_point['latitude'], selected_point['longitude']],
+            popup=f"OAE: {selected_point['cod_sgo']}",
+            icon=folium.Icon(color='red', icon='info-sign')
+        ).add_to(group)
+    return group, clustered
+
+# Backends de renderização do mapa: Folium/Leaflet (HTML com as feições em
+# GeoJSON) ou WebGL (pydeck/deck.gl), que desenha a malha nacional inteira
+MAP_BACKENDS = {
+    'Folium (Leaflet)': 'folium',
+    'WebGL (pydeck)': 'pydeck',
+}
+# Cores do color_map em RGB (0-255) para o deck.gl
+DECK_COLORS = {key: [round(255 * c) for c in mcolors.to_rgb(color)] for key, color in color_map.items()}
+DECK_OAE_COLOR = [0, 0, 0, 128]
+DECK_SELECTED_COLOR = [255, 0, 0, 230]
+
+
+def tooltip_html(df, fields):
+    # Tooltip de cada linha como HTML pronto ("<b>campo:</b> valor"), montado
+    # de forma vetorizada e com os valores escapados
+    parts = []
+    for field in fields:
+        values = df[field].astype(object).where(df[field].notna(), '').astype(str)
+        values = values.str.replace('&', '&amp;').str.replace('<', '&lt;').str.replace('>', '&gt;')
+        parts.append(f'<b>{field}:</b> ' + values)
+    return pd.concat(parts, axis=1).agg('<br>'.join, axis=1) if parts else pd.Series('', index=df.index)
+
+
+def snv_deck_data(filtered_snv):
+    # Dados colunares da PathLayer: um caminho plano [lon, lat, lon, lat, ...]
+    # por parte de cada segmento (nível de detalhe de select_snv_lod, lido com
+    # positionFormat 'XY'), cor RGB em colunas e tooltip com os campos de
+    # lista_snv. O JSON do st.pydeck_chart ainda exige uma lista Python por
+    # caminho: as coordenadas viram uma lista só e cada caminho é uma fatia
+    # dela, sem um par [lon, lat] por vértice.
+    snv = select_snv_lod(filtered_snv).to_crs(epsg=4326)
+    parts, part_index = shapely.get_parts(np.asarray(snv.geometry.array), return_index=True)
+    coords, coord_index = shapely.get_coordinates(parts, return_index=True)
+    flat = coords.round(6).ravel().tolist()
+    ends = (2 * np.cumsum(np.bincount(coord_index, minlength=len(parts)))).tolist()
+    paths = [flat[start:end] for start, end in zip([0] + ends[:-1], ends)]
+    rgb = np.array([DECK_COLORS.get(value, [128, 128, 128]) for value in snv['ds_tipo_ad'].astype(str)], dtype=np.int64).reshape(-1, 3)
+    return pd.DataFrame({
+        'path': paths,
+        'r': rgb[part_index, 0],
+        'g': rgb[part_index, 1],
+        'b': rgb[part_index, 2],
+        'tooltip': tooltip_html(snv, lista_snv).to_numpy()[part_index],
+    })
+
+
+def oae_deck_data(filtered_oae):
+    # Dados colunares da ScatterplotLayer: lon/lat e tooltip com lista_oae
+    valid = (filtered_oae['latitude'].notna() & filtered_oae['longitude'].notna()).to_numpy()
+    oae = filtered_oae[valid]
+    return pd.DataFrame({
+        'lon': oae['longitude'].to_numpy(dtype=float).round(6),
+        'lat': oae['latitude'].to_numpy(dtype=float).round(6),
+        'tooltip': tooltip_html(oae, lista_oae).to_numpy(),
+    })
+
+
+def deck_view_state(bounds, width=MAP_WIDTH):
+    # Centro e zoom (Web Mercator, tiles de 256 px) que enquadram os limites
+    if bounds is None:
+        return pdk.ViewState(latitude=-15.0, longitude=-53.0, zoom=3.5)
+    (south, west), (north, east) = bounds
+    extent = max(east - west, (north - south) * 1.2, 1e-4)
+    zoom = float(np.clip(np.log2(width * 360 / (256 * extent)), 2, 16))
+    return pdk.ViewState(latitude=(south + north) / 2, longitude=(west + east) / 2, zoom=zoom)
+
+
+def create_deck(filtered_snv, filtered_oae, selected_point=None, bounds=None):
+    # Mesmo conteúdo de create_map, desenhado pelo deck.gl: SNV como
+    # PathLayer (cores do color_map), OAEs como ScatterplotLayer e a OAE
+    # selecionada destacada em vermelho. Strings sem aspas viram expressões do
+    # deck.gl (nomes de coluna); valores literais vão entre aspas ('"pixels"').
+    layers = []
+    if len(filtered_snv):
+        layers.append(pdk.Layer(
+            'PathLayer',
+            snv_deck_data(filtered_snv),
+            id='snv',
+            get_path='path',
+            position_format='"XY"',
+            get_color='[r, g, b]',
+            get_width=2,
+            width_units='"pixels"',
+            pickable=True,
+            auto_highlight=True,
+        ))
+    if len(filtered_oae):
+        layers.append(pdk.Layer(
+            'ScatterplotLayer',
+            oae_deck_data(filtered_oae),
+            id='oae',
+            get_position='[lon, lat]',
+            get_radius=4,
+            radius_units='"pixels"',
+            get_fill_color=DECK_OAE_COLOR,
+            get_line_color=[0, 0, 0],
+            line_width_min_pixels=1,
+            stroked=True,
+            pickable=True,
+            auto_highlight=True,
+        ))
+    if selected_point is not None:
+        layers.append(pdk.Layer(
+            'ScatterplotLayer',
+            pd.DataFrame({
+                'lon': [selected_point['longitude']],
+                'lat': [selected_point['latitude']],
+                'tooltip': [f"<b>OAE:</b> {selected_point['cod_sgo']}"],
+            }),
+            id='selected_oae',
+            get_position='[lon, lat]',
+            get_radius=9,
+            radius_units='"pixels"',
+            get_fill_color=DECK_SELECTED_COLOR,
+            get_line_color=[255, 255, 255],
+            line_width_min_pixels=2,
+            stroked=True,
+            pickable=True,
+        ))
+    return pdk.Deck(
+        layers=layers,
+        initial_view_state=deck_view_state(bounds),
+        map_provider='carto',
+        map_style='road',
+        tooltip={'html': '{tooltip}', 'style': {'fontFamily': 'Arial', 'fontSize': '12px'}},
+    )
 
 # PARTE 2 - STREAMLIT
 
@@ -168,80 +989,43 @@ st.set_page_config(page_title="Mapa OAE", layout="wide")
 
 st.title("Mapa OAE")
 
-# Seção de upload de arquivos
-st.sidebar.header("Upload de Arquivos Obrigatórios")
-
 # Dicionário para armazenar os arquivos carregados
 uploaded_files = {}
 
-# Upload do arquivo Excel base_oae_colep
-uploaded_excel = st.sidebar.file_uploader("Base OAE (Excel)", type=['xlsx'], key='base_oae_colep')
-if uploaded_excel is not None:
-    uploaded_files['base_oae_colep'] = uploaded_excel
+# Seção de upload de arquivos (dispensada quando há dataset pré-processado)
+if PRECOMPUTED_DIR:
+    st.sidebar.caption(f"Dataset pré-processado: {PRECOMPUTED_DIR}")
+else:
+    st.sidebar.header("Upload de Arquivos Obrigatórios")
+
+    # Upload do arquivo Excel base_oae_colep
+    uploaded_excel = st.sidebar.file_uploader("Base OAE (Excel)", type=['xlsx'], key='base_oae_colep')
+    if uploaded_excel is not None:
+        uploaded_files['base_oae_colep'] = uploaded_excel
 
-# Upload do shapefile SNV (deve ser um zip)
-uploaded_snv = st.sidebar.file_uploader("Shapefile SNV (ZIP contendo .shp, .dbf, etc)", type=['zip'], key='SNV_202501A')
-if uploaded_snv is not None:
-    uploaded_files['SNV_202501A'] = uploaded_snv
+    # Upload do shapefile SNV (deve ser um zip)
+    uploaded_snv = st.sidebar.file_uploader("Shapefile SNV (ZIP contendo .shp, .dbf, etc)", type=['zip'], key='SNV_202501A')
+    if uploaded_snv is not None:
+        uploaded_files['SNV_202501A'] = uploaded_snv
 
-# Upload do arquivo CSV
-uploaded_csv = st.sidebar.file_uploader("Relatório SGO (CSV)", type=['csv'], key='23012025_relatoriosEmLote')
-if uploaded_csv is not None:
-    uploaded_files['23012025_relatoriosEmLote'] = uploaded_csv
+    # Upload do arquivo CSV
+    uploaded_csv = st.sidebar.file_uploader("Relatório SGO (CSV)", type=['csv'], key='23012025_relatoriosEmLote')
+    if uploaded_csv is not None:
+        uploaded_files['23012025_relatoriosEmLote'] = uploaded_csv
 
-# Upload do shapefile BR_UF (deve ser um zip)
-uploaded_uf = st.sidebar.file_uploader("Shapefile BR_UF (ZIP contendo .shp, .dbf, etc)", type=['zip'], key='BR_UF_2022')
-if uploaded_uf is not None:
-    uploaded_files['BR_UF_2022'] = uploaded_uf
+    # Upload do shapefile BR_UF (deve ser um zip)
+    uploaded_uf = st.sidebar.file_uploader("Shapefile BR_UF (ZIP contendo .shp, .dbf, etc)", type=['zip'], key='BR_UF_2022')
+    if uploaded_uf is not None:
+        uploaded_files['BR_UF_2022'] = uploaded_uf
 
 # Verificar se todos os arquivos foram carregados antes de continuar
-if len(uploaded_files) == 4:
-    df_snv, df_oae = load_data(uploaded_files)
+if PRECOMPUTED_DIR or len(uploaded_files) == 4:
+    df_snv, df_oae = load_precomputed(PRECOMPUTED_DIR) if PRECOMPUTED_DIR else load_data(uploaded_files)
     
     # Restante do código (igual ao original)...
-    # Função para buscar sugestões
-    def search_oae(searchterm: str, df: pd.DataFrame) -> list[tuple[str, str]]:
-        # Converte para string e remove valores nulos
-        df = df.dropna(subset=['cod_sgo', 'descr_obra'])
-        df['cod_sgo'] = df['cod_sgo'].astype(str)
-        df['descr_obra'] = df['descr_obra'].astype(str)
-        
-        if not searchterm:
-            return []
-        
-        searchterm = searchterm.lower()
-        
-        # Cria colunas combinadas para pesquisa nos dois formatos
-        df['cod_desc'] = df['cod_sgo'] + " - " + df['descr_obra']
-        df['desc_cod'] = df['descr_obra'] + " - " + df['cod_sgo']
-        
-        # Busca em todas as colunas relevantes
-        mask = (df['cod_sgo'].str.lower().str.contains(searchterm)) | \
-               (df['descr_obra'].str.lower().str.contains(searchterm)) | \
-               (df['cod_desc'].str.lower().str.contains(searchterm)) | \
-               (df['desc_cod'].str.lower().str.contains(searchterm))
-        
-        results = df.loc[mask]
-        
-        # Formata os resultados para exibição (usando o formato código - descrição)
-        suggestions = [
-            (f"{row['cod_sgo']} - {row['descr_obra']}", row['cod_sgo'])
-            for _, row in results.iterrows()
-        ]
-        
-        # Remove duplicados mantendo a primeira ocorrência
-        seen = set()
-        unique_suggestions = []
-        for sug in suggestions:
-            if sug[0] not in seen:
-                seen.add(sug[0])
-                unique_suggestions.append(sug)
-        
-        return unique_suggestions
-
     # Função para buscar sugestões com Street View
     def search_oae_with_streetview(searchterm: str):
-        suggestions = search_oae(searchterm, df_oae)
+        suggestions = search_oae(searchterm, get_search_index(df_oae.attrs['dataset_key'], df_oae))
         # Adiciona opção de Street View para cada sugestão
         return [(f"{label} (Abrir Street View)", value) for label, value in suggestions]
 
@@ -254,95 +1038,16 @@ if len(uploaded_files) == 4:
         url = f"https://www.google.com/maps?q=&layer=c&cbll={latitude},{longitude}"
         webbrowser.open_new_tab(url)
 
-    # Definir listas para tooltips
-    lista_snv = ['vl_br', 'sg_uf', 'vl_codigo', 'ds_coinc', 'ds_tipo_ad', 'ds_jurisdi','ds_superfi','ul']
-    lista_oae = ['cod_sgo', 'descr_obra', 'tipo_obra','nota_sgo', 'origem_cadastro', 'uf_2', 'vl_codigo', 'ds_tipo_ad','ds_jurisdi', 'ul_2']
-
-    # Mapeamento de cores
-    color_map = {
-        'Convênio Adm.Federal/Estadual': 'cyan',
-        'Federal': 'red',
-        'Distrital': 'cyan',
-        'Estadual': 'cyan',
-        'Municipal': 'cyan',
-        'Concessão Federal': 'cyan',
-        'Convênio Adm.Federal/Municipal': 'cyan'
-    }
-
-    # Filtrar df_snv apenas para valores mapeados
-    df_snv['ds_tipo_ad'] = df_snv['ds_tipo_ad'].astype(str)
-    df_snv = df_snv[df_snv['ds_tipo_ad'].isin(color_map.keys())]
-
-    # Função para criar o mapa
-    def create_map(filtered_snv, filtered_oae, selected_point=None):
-        m = filtered_snv.explore(
-            column='ds_tipo_ad',
-            cmap=list(color_map.values()),
-            categories=list(color_map.keys()),
-            style_kwds={"fillOpacity": 0.1},
-            tooltip=lista_snv,
-            categorical=True,
-            name="Rodovias(SNV)",
-            tiles="OpenStreetMap"
-        )
-        
-        # Adicione este bloco para marcar o ponto selecionado
-        if selected_point is not None:
-            folium.Marker(
-                location=[selected_point['latitude'], selected_point['longitude']],
-                popup=f"OAE: {selected_point['cod_sgo']}",
-                icon=folium.Icon(color='red', icon='info-sign')
-            ).add_to(m)
-        
-        # Adicionar pontos OAE com tooltip personalizado
-        for _, row in filtered_oae.iterrows():
-            # Criar conteúdo HTML para o tooltip
-            html = f"""
-            <div style="font-family: Arial; font-size: 12px">
-                <b>Código SGO:</b> {row['cod_sgo']}<br>
-                <b>Descrição:</b> {row['descr_obra']}<br>
-                <b>Tipo Obra:</b> {row['tipo_obra']}<br>
-                <b>Nota SGO:</b> {row['nota_sgo']}<br>
-                <b>BR:</b> {row['br']}<br>
-                <b>UF:</b> {row['uf_2']}<br>
-                <a href="{row['streetview_link']}" target="_blank" style="color: blue; text-decoration: underline;">
-                    Abrir no Street View
-                </a>
-            </div>
-            """
-            
-            iframe = folium.IFrame(html, width=250, height=150)
-            popup = folium.Popup(iframe, max_width=250)
-            
-            folium.CircleMarker(
-                location=[row['latitude'], row['longitude']],
-                radius=4,
-                color='black',
-                fill=True,
-                fill_opacity=0.5,
-                popup=popup
-            ).add_to(m)
-        
-        # Adicionar diferentes tipos de mapas base
-        folium.TileLayer('OpenStreetMap', name='Rodovias').add_to(m)
-        folium.TileLayer('CartoDB.Positron', name='Light Mode').add_to(m)
-        folium.TileLayer('CartoDB.DarkMatter', name='Dark Mode').add_to(m)
-        folium.TileLayer(
-            tiles='https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
-            attr='Google',
-            name='Satélite (Google)',
-            max_zoom=20
-        ).add_to(m)
-        
-        folium.LayerControl().add_to(m)
-        return m
+    # Índice de facetas do dataset (códigos por coluna, ver build_facets)
+    facets = get_facet_index(df_oae.attrs['dataset_key'], df_oae, df_snv)
+    oae_facets, snv_facets = facets['oae'], facets['snv']
 
     # Sidebar para filtros
     with st.sidebar:
         st.header("Filtros")
         
         # Filtro de UF
-        uf_options = ['Todos'] + sorted(df_oae['uf'].dropna().unique().tolist())
+        uf_options = ['Todos'] + facet_options(oae_facets, 'uf')
         selected_uf = st.selectbox(
             "UF",
             uf_options,
@@ -351,9 +1056,7 @@ if len(uploaded_files) == 4:
         )
         
         # Filtro de Conflitos (segundo filtro)
-        temp_conflito_df = df_oae.copy()
-        if selected_uf != 'Todos':
-            temp_conflito_df = temp_conflito_df[temp_conflito_df['uf'] == selected_uf]
+        mask_uf = facet_mask(oae_facets, 'uf', selected_uf)
         
         conflito_options = ['Todos', 'Sim', 'Não']
         selected_conflito = st.selectbox(
@@ -362,118 +1065,98 @@ if len(uploaded_files) == 4:
             key="conflitos",
             index=0 if 'conflitos' not in st.session_state else conflito_options.index(st.session_state.conflitos) if st.session_state.conflitos in conflito_options else 0
         )
+        mask_conflito = facet_mask(oae_facets, 'conflitos', selected_conflito, mask_uf)
         
         # Filtro de Tipo de Conflito (depende de Conflitos == 'Sim')
         if selected_conflito == 'Sim':
-            temp_tipo_conflito_df = temp_conflito_df.copy()
-            if selected_conflito != 'Todos':
-                temp_tipo_conflito_df = temp_tipo_conflito_df[temp_tipo_conflito_df['conflitos'] == selected_conflito]
-            
-            # Filtro Tipo de Conflito
-            tipo_conflito_options = ['Todos'] + sorted(temp_tipo_conflito_df['tipo_conflito'].dropna().unique().tolist())
+            tipo_conflito_options = ['Todos'] + facet_options(oae_facets, 'tipo_conflito', mask_conflito)
             selected_tipo_conflito = st.selectbox(
                 "Tipo de Conflito",
                 tipo_conflito_options,
                 key="tipo_conflito",
                 index=0 if 'tipo_conflito' not in st.session_state else tipo_conflito_options.index(st.session_state.tipo_conflito) if st.session_state.tipo_conflito in tipo_conflito_options else 0
             )
+            mask_tipo_conflito = facet_mask(oae_facets, 'tipo_conflito', selected_tipo_conflito, mask_conflito)
         else:
             selected_tipo_conflito = None
+            mask_tipo_conflito = mask_conflito
         
     # Novo Filtro de Tipo de Administração (depende de UF, Conflitos e Tipo de Conflito)
-        temp_tipo_ad_df = df_oae.copy()
-        if selected_uf != 'Todos':
-            temp_tipo_ad_df = temp_tipo_ad_df[temp_tipo_ad_df['uf'] == selected_uf]
-        if selected_conflito != 'Todos':
-            temp_tipo_ad_df = temp_tipo_ad_df[temp_tipo_ad_df['conflitos'] == selected_conflito]
-        if selected_conflito == 'Sim' and selected_tipo_conflito and selected_tipo_conflito != 'Todos':
-            temp_tipo_ad_df = temp_tipo_ad_df[temp_tipo_ad_df['tipo_conflito'] == selected_tipo_conflito]
-        
-        tipo_ad_options = ['Todos'] + sorted(temp_tipo_ad_df['ds_tipo_ad'].dropna().unique().tolist())
+        tipo_ad_options = ['Todos'] + facet_options(oae_facets, 'ds_tipo_ad', mask_tipo_conflito)
         selected_tipo_ad = st.selectbox(
             "Tipo de Administração",
             tipo_ad_options,
             key="ds_tipo_ad",
             index=0 if 'ds_tipo_ad' not in st.session_state else tipo_ad_options.index(st.session_state.ds_tipo_ad) if st.session_state.ds_tipo_ad in tipo_ad_options else 0
         )
+        mask_tipo_ad = facet_mask(oae_facets, 'ds_tipo_ad', selected_tipo_ad, mask_tipo_conflito)
 
     # Filtro de br (agora depende também do Tipo de Administração)
-        temp_br_df = temp_tipo_ad_df.copy()
-        if selected_tipo_ad != 'Todos':
-            temp_br_df = temp_br_df[temp_br_df['ds_tipo_ad'] == selected_tipo_ad]
-        
-        br_options = ['Todos'] + sorted(temp_br_df['br'].dropna().unique().tolist())
+        br_options = ['Todos'] + facet_options(oae_facets, 'br', mask_tipo_ad)
         selected_br = st.selectbox(
             "Rodovia",
             br_options,
             key="br",
             index=0 if 'br' not in st.session_state else br_options.index(st.session_state.br) if st.session_state.br in br_options else 0
         )
+        mask_br = facet_mask(oae_facets, 'br', selected_br, mask_tipo_ad)
         
         # Filtro de Tipo de Obra (agora depende também do Tipo de Administração)
-        temp_tipo_df = temp_br_df.copy()
-        if selected_br != 'Todos':
-            temp_tipo_df = temp_tipo_df[temp_tipo_df['br'] == selected_br]
-        
-        tipo_obra_options = ['Todos'] + sorted(temp_tipo_df['tipo_obra'].dropna().unique().tolist())
+        tipo_obra_options = ['Todos'] + facet_options(oae_facets, 'tipo_obra', mask_br)
         selected_tipo_obra = st.selectbox(
             "Tipo de Obra",
             tipo_obra_options,
             key="tipo_obra",
             index=0 if 'tipo_obra' not in st.session_state else tipo_obra_options.index(st.session_state.tipo_obra) if st.session_state.tipo_obra in tipo_obra_options else 0
         )
+        mask_tipo_obra = facet_mask(oae_facets, 'tipo_obra', selected_tipo_obra, mask_br)
         
         # Filtro de Nota (agora depende também do Tipo de Administração)
-        temp_nota_df = temp_tipo_df.copy()
-        if selected_tipo_obra != 'Todos':
-            temp_nota_df = temp_nota_df[temp_nota_df['tipo_obra'] == selected_tipo_obra]
-        
-        nota_options = ['Todos'] + sorted(temp_nota_df['nota_sgo'].dropna().astype(str).unique().tolist())
+        nota_options = ['Todos'] + facet_options(oae_facets, 'nota_sgo', mask_tipo_obra)
         selected_nota = st.selectbox(
             "Nota",
             nota_options,
             key="nota_sgo",
             index=0 if 'nota_sgo' not in st.session_state else nota_options.index(st.session_state.nota_sgo) if st.session_state.nota_sgo in nota_options else 0
         )
+        mask_nota = facet_mask(oae_facets, 'nota_sgo', selected_nota, mask_tipo_obra)
 
-    # Aplicar filtros
-    filtered_oae = df_oae.copy()
-    filtered_snv = df_snv.copy()
-
-    # Aplicar filtro de UF
-    if selected_uf != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['uf'] == selected_uf]
-        filtered_snv = filtered_snv[filtered_snv['sg_uf'] == selected_uf]
-
-    # Aplicar filtro de Conflitos
-    if selected_conflito != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['conflitos'] == selected_conflito]
-
-    # Aplicar filtro de Tipo de Conflito (se aplicável)
-    if selected_conflito == 'Sim' and selected_tipo_conflito and selected_tipo_conflito != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['tipo_conflito'] == selected_tipo_conflito]
-
-    # Aplicar filtro de Tipo de Administração
-    if selected_tipo_ad != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['ds_tipo_ad'] == selected_tipo_ad]
-        filtered_snv = filtered_snv[filtered_snv['ds_tipo_ad'] == selected_tipo_ad]
-
-    # Aplicar outros filtros
-    if selected_br != 'Todos':
-        br_selecionado = str(selected_br).zfill(3)
-        filtered_oae = filtered_oae[filtered_oae['br'].astype(str).str.zfill(3) == br_selecionado]
-        filtered_snv = filtered_snv[filtered_snv['vl_br'].astype(str).str.zfill(3) == br_selecionado]
+        # Modo de renderização das OAEs no mapa
+        st.header("Mapa")
+        selected_render_mode = st.selectbox(
+            "Renderização das OAEs",
+            list(OAE_RENDER_MODES.keys()),
+            key="oae_render_mode"
+        )
+        selected_snv_mode = st.selectbox(
+            "Rodovias (SNV)",
+            list(SNV_RENDER_MODES.keys()),
+            key="snv_render_mode"
+        )
+        selected_backend = st.selectbox(
+            "Backend do mapa",
+            list(MAP_BACKENDS.keys()),
+            key="map_backend"
+        )
+        selected_viewport = st.checkbox(
+            "Carregar só a área visível",
+            key="viewport_mode",
+            help="O mapa recebe apenas as OAEs e rodovias dentro da vista atual, "
+                 "atualizadas ao mover ou aproximar o mapa",
+        )
 
-    if selected_tipo_obra != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['tipo_obra'] == selected_tipo_obra]
-        
-    if selected_nota != 'Todos':
-        filtered_oae = filtered_oae[filtered_oae['nota_sgo'].astype(str) == selected_nota]
+    # Aplicar filtros: uma única seleção por máscara, sem cópias intermediárias
+    # (posições das linhas; o dataset compartilhado não é copiado)
+    oae_rows = filtered_rows(mask_nota, len(df_oae))
+    mask_snv = facet_mask(snv_facets, 'sg_uf', selected_uf)
+    mask_snv = facet_mask(snv_facets, 'ds_tipo_ad', selected_tipo_ad, mask_snv)
+    mask_snv = facet_mask(snv_facets, 'vl_br', selected_br, mask_snv)
+    snv_rows = filtered_rows(mask_snv, len(df_snv))
         
     # Mostrar contagem de registros
     col1, col2 = st.columns(2)
-    col1.write(f"SNV visíveis: {len(filtered_snv)}")
-    col2.write(f"Obras de Arte Especiais visíveis: {len(filtered_oae)}")
+    col1.write(f"SNV visíveis: {len(snv_rows)}")
+    col2.write(f"Obras de Arte Especiais visíveis: {len(oae_rows)}")
 
     # Seção Street View integrada com pesquisa inteligente
     st.subheader("Street View - Visualização por OAE")
@@ -489,13 +1172,13 @@ if len(uploaded_files) == 4:
     if selected_streetview:
         # Extrai o código SGO da seleção (remove o "(Abrir Street View)" do label)
         codigo_sgo = selected_streetview.split(" - ")[0]
-        obra_data = df_oae[df_oae['cod_sgo'].astype(str) == codigo_sgo].iloc[0]
+        obra_data = df_oae.iloc[np.flatnonzero(df_oae['cod_sgo'].to_numpy() == codigo_sgo)[0]]
         
         st.session_state.selected_obra_streetview = {
             'cod_sgo': obra_data['cod_sgo'],
             'descr_obra': obra_data['descr_obra'],
-            'latitude': float(obra_data['latitude'].split(';')[0]),
-            'longitude': float(obra_data['longitude'].split(';')[0])
+            'latitude': float(obra_data['latitude']),
+            'longitude': float(obra_data['longitude'])
         }
 
     # Mostra detalhes e botão se houver obra selecionada
@@ -508,10 +1191,110 @@ if len(uploaded_files) == 4:
             open_street_view(obra['latitude'], obra['longitude'])
 
     # Criar e exibir o mapa
-    if not filtered_snv.empty or not filtered_oae.empty:
-        m = create_map(filtered_snv, filtered_oae, st.session_state.selected_obra_streetview)
-        folium_static(m, width=1400, height=800)
+    map_recorder = pipeline.StageRecorder()
+    filter_key = (
+        selected_uf, selected_conflito, selected_tipo_conflito, selected_tipo_ad,
+        selected_br, selected_tipo_obra, selected_nota, df_oae.attrs['dataset_key'],
+    )
+    use_deck = MAP_BACKENDS[selected_backend] == 'pydeck'
+    viewport_index = get_viewport_index(df_oae.attrs['dataset_key'], df_oae, df_snv) if selected_viewport or use_deck else None
+    initial_bounds = data_bounds(viewport_index, snv_rows, oae_rows) if viewport_index is not None else None
+    if use_deck and (len(snv_rows) or len(oae_rows)):
+        # WebGL: todas as feições filtradas, sem limite de quantidade
+        with map_recorder:
+            with pipeline.stage('create_deck', rows=len(oae_rows) + len(snv_rows)):
+                deck = create_deck(df_snv.iloc[snv_rows], df_oae.iloc[oae_rows],
+                                   st.session_state.selected_obra_streetview, initial_bounds)
+            with pipeline.stage('pydeck_chart'):
+                st.pydeck_chart(deck, height=MAP_HEIGHT)
+    elif selected_viewport and initial_bounds is not None:
+        # Mapa base fixo enquanto os filtros não mudam (enquadrado na seleção);
+        # a cada movimento só a camada da vista é recalculada e enviada
+        selected_point = st.session_state.selected_obra_streetview
+        bounds, zoom = None, None
+        if st.session_state.get('viewport_filter_key') == filter_key:
+            view_state = st.session_state.get('viewport_map') or {}
+            bounds = viewport_bounds(view_state.get('bounds'))
+            if bounds is not None and isinstance(view_state.get('zoom'), (int, float)):
+                zoom = view_state['zoom']
+        bounds = bounds or initial_bounds
+        with map_recorder:
+            with pipeline.stage('viewport_query') as record:
+                view_oae_rows, view_snv_rows, snv_total, extent = query_viewport(
+                    viewport_index, bounds, mask_nota, mask_snv)
+                record['rows'] = len(view_oae_rows) + len(view_snv_rows)
+            with pipeline.stage('create_viewport_layers', rows=len(view_oae_rows) + len(view_snv_rows),
+                                zoom=zoom) as record:
+                layers, clustered = create_viewport_layers(
+                    df_snv.iloc[view_snv_rows], df_oae.iloc[view_oae_rows], bounds, extent, selected_point,
+                    zoom=zoom)
+                record['clustered'] = clustered
+            m = folium.Map(tiles=None)
+            m.fit_bounds([list(corner) for corner in initial_bounds])
+            add_base_layers(m)
+            with pipeline.stage('st_folium'):
+                st_folium(m, key='viewport_map', width=MAP_WIDTH, height=MAP_HEIGHT,
+                          returned_objects=['bounds', 'zoom'], feature_group_to_add=layers)
+        st.session_state['viewport_filter_key'] = filter_key
+        st.caption(
+            f"Na vista: {len(view_oae_rows)} OAEs{' (agrupadas)' if clustered else ''} e "
+            f"{snv_total} segmentos SNV"
+            + (f" (exibidos os {len(view_snv_rows)} mais longos)" if snv_total > len(view_snv_rows) else "")
+        )
+    elif len(snv_rows) or len(oae_rows):
+        snv_tiles_url, snv_filters = None, None
+        if SNV_RENDER_MODES[selected_snv_mode] == 'tiles':
+            # Os tiles cobrem todo o SNV; os filtros são aplicados no navegador
+            snv_tiles_url = get_snv_tiles(df_snv.attrs['dataset_key'], df_snv)
+            if snv_tiles_url is None:
+                st.warning("Servidor de tiles indisponível; o SNV foi incluído na página (GeoJSON).")
+            snv_filters = [
+                [prop, str(value).zfill(width), width]
+                for prop, value, width in [('sg_uf', selected_uf, 0), ('ds_tipo_ad', selected_tipo_ad, 0), ('vl_br', selected_br, 3)]
+                if value != 'Todos'
+            ]
+        selected_point = st.session_state.selected_obra_streetview
+        map_key = (
+            selected_uf, selected_conflito, selected_tipo_conflito, selected_tipo_ad,
+            selected_br, selected_tipo_obra, selected_nota,
+            (selected_point['cod_sgo'], selected_point['latitude'], selected_point['longitude']) if selected_point else None,
+            df_oae.attrs['dataset_key'],
+            selected_render_mode, selected_snv_mode, snv_tiles_url,
+        )
+        map_cache = get_map_html_cache()
+        with map_recorder:
+            map_html = map_cache.get(map_key)
+            cache_hit = map_html is not None
+            if not cache_hit:
+                # Só aqui as linhas filtradas são copiadas do dataset compartilhado
+                with pipeline.stage('create_map', rows=len(oae_rows) + len(snv_rows)):
+                    m = create_map(df_snv.iloc[snv_rows], df_oae.iloc[oae_rows], selected_point,
+                                   oae_mode=OAE_RENDER_MODES[selected_render_mode],
+                                   snv_tiles_url=snv_tiles_url, snv_filters=snv_filters)
+                with pipeline.stage('render_map_html') as record:
+                    map_html = render_map_html(m)
+                    record['bytes'] = len(map_html)
+                map_cache.put(map_key, map_html)
+            # Equivalente ao folium_static: envio do HTML para o navegador
+            with pipeline.stage('folium_static', cached=cache_hit):
+                components.html(map_html, height=MAP_HEIGHT + 10, width=MAP_WIDTH)
+
+        cache_stats = map_cache.stats()
+        st.sidebar.caption(
+            f"Cache do mapa: {cache_stats['hits']} acertos, {cache_stats['misses']} faltas, "
+            f"{cache_stats['entries']} mapas ({cache_stats['bytes'] / 1024 ** 2:.1f} MB)"
+        )
     else:
         st.warning("Nenhum dado encontrado com os filtros selecionados.")
+
+    # Tempo, memória e linhas de cada etapa da carga e do mapa
+    with st.sidebar.expander("Diagnóstico"):
+        st.caption(
+            f"Carga dos dados (dataset compartilhado entre as sessões: "
+            f"{get_dataset_memory(df_oae.attrs['dataset_key'], df_snv, df_oae):.0f} MB)"
+        )
+        st.dataframe(pd.DataFrame(df_oae.attrs.get('stage_timings', [])), hide_index=True)
+        st.caption("Mapa (última execução)")
+        st.dataframe(pd.DataFrame(map_recorder.records), hide_index=True)
 else:
     st.warning("Por favor, carregue todos os arquivos necessários para continuar.")
@@ -0,0 +1,1127 @@
+# Pipeline de dados do mapa OAE, sem dependência do Streamlit: leitura dos
+# quatro arquivos de entrada, cruzamentos espaciais, agregação e classificação
+# dos conflitos, com cache em disco (GeoParquet).
+#
+# Também pode ser executado em lote, fora do app:
+#
+#   python pipeline.py --base-oae base_oae_colep.xlsx --snv SNV_202501A.zip \
+#       --sgo 23012025_relatoriosEmLote.csv --uf BR_UF_2022.zip --output saida/
+#
+# A saída (df_oae / df_snv em GeoParquet e, opcionalmente, CSV, em
+# saida/dataset-*/, indicada por saida/dataset.json) pode ser aberta direto
+# pelo app com MAPA_OAE_DATA_DIR=saida/; uma nova execução é detectada pelo
+# app sem reiniciar.
+import argparse
+import contextlib
+import contextvars
+import functools
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyogrio.errors
+import pyproj
+import shapely
+from pandas.io.parsers import TextParser
+
+logger = logging.getLogger('mapa_oae.pipeline')
+# Um registro JSON por etapa medida (ver stage)
+stage_logger = logging.getLogger('mapa_oae.stages')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class PipelineError(Exception):
+    # Erro nos arquivos de entrada, com mensagem para o usuário
+    pass
+
+
+# Instrumentação das etapas: tempo de parede, memória e número de linhas.
+# Memória de cada etapa: RSS ao final (rss_mb), variação durante a etapa
+# (rss_delta_mb) e maior RSS amostrado enquanto ela rodava (stage_peak_rss_mb,
+# ver RssSampler); process_peak_rss_mb é o pico da vida inteira do processo.
+# Cada etapa vira um registro no StageRecorder ativo (se houver) e uma linha
+# de log JSON em 'mapa_oae.stages'.
+MB = 1024 ** 2
+_active_recorder = contextvars.ContextVar('mapa_oae_stage_recorder', default=None)
+
+
+def current_rss():
+    # RSS atual em bytes (Linux); None se indisponível
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    # Pico de RSS do processo em bytes; None se indisponível
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    # Thread que lê o RSS a cada `interval` segundos enquanto há etapas
+    # abertas e guarda o maior valor visto por cada uma (etapas aninhadas ou
+    # em threads paralelas são acompanhadas ao mesmo tempo)
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}
+        self.thread = None
+
+    def start(self, rss):
+        token = object()
+        with self.lock:
+            self.active[token] = rss
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self.thread.start()
+        return token
+
+    def stop(self, token, rss):
+        with self.lock:
+            return max(self.active.pop(token), rss)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss() or 0
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                for token, peak in self.active.items():
+                    if rss > peak:
+                        self.active[token] = rss
+
+
+_rss_sampler = RssSampler()
+
+
+class StageRecorder:
+    # Acumula os registros das etapas executadas dentro de `with recorder:`
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_active_recorder.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        _active_recorder.reset(self._tokens.pop())
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    # Mede o bloco como uma etapa. O registro devolvido pode receber campos
+    # durante a execução (ex.: record['rows'] = len(df)).
+    record = {'stage': name, **fields}
+    rss_start = current_rss()
+    token = _rss_sampler.start(rss_start) if rss_start is not None else None
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record['error'] = True
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        rss, peak = current_rss(), peak_rss()
+        if token is not None and rss is not None:
+            record['rss_mb'] = round(rss / MB, 1)
+            record['rss_delta_mb'] = round((rss - rss_start) / MB, 1)
+            record['stage_peak_rss_mb'] = round(_rss_sampler.stop(token, rss) / MB, 1)
+        else:
+            record['rss_mb'] = None
+        record['process_peak_rss_mb'] = round(peak / MB, 1) if peak is not None else None
+        recorder = _active_recorder.get()
+        if recorder is not None:
+            recorder.add(record)
+        stage_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def submit(executor, fn, *args, **kwargs):
+    # executor.submit preservando o StageRecorder ativo na thread de destino
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Arquivos obrigatórios, na ordem usada para calcular o hash do cache
+REQUIRED_FILES = ['base_oae_colep', 'SNV_202501A', '23012025_relatoriosEmLote', 'BR_UF_2022']
+
+# Versão do pipeline: incrementar sempre que o processamento mudar o resultado,
+# para invalidar as entradas antigas do cache em disco
+PIPELINE_VERSION = '7'
+
+# Cache em disco (GeoParquet) que sobrevive a reinícios e redeploys do app
+CACHE_DIR = os.environ.get('MAPA_OAE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache_oae'))
+CACHE_MAX_BYTES = int(os.environ.get('MAPA_OAE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+CACHE_MAX_AGE_DAYS = float(os.environ.get('MAPA_OAE_CACHE_MAX_AGE_DAYS', 30))
+
+
+def file_bytes(uploaded_file):
+    # Aceita UploadedFile do Streamlit, BytesIO ou caminho no disco
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, 'rb') as f:
+            return f.read()
+    if hasattr(uploaded_file, 'getvalue'):
+        return uploaded_file.getvalue()
+    pos = uploaded_file.tell()
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(pos)
+    return data
+
+
+def hash_uploaded_files(uploaded_files, keys=REQUIRED_FILES):
+    # Hash do conteúdo dos arquivos + versão do pipeline
+    h = hashlib.sha256(f"pipeline={PIPELINE_VERSION}".encode())
+    for key in keys:
+        h.update(key.encode())
+        h.update(hashlib.sha256(file_bytes(uploaded_files[key])).digest())
+    return h.hexdigest()
+
+
+def cache_entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age_days=CACHE_MAX_AGE_DAYS):
+    # Remove entradas mais antigas que max_age_days e, depois, as menos usadas
+    # recentemente até o total ficar abaixo de max_bytes
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+        entries.append((os.path.getmtime(path), cache_entry_size(path), path))
+
+    now = time.time()
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime > max_age_days * 86400 or total > max_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def read_cache(key, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, key)
+    try:
+        df_snv = gpd.read_parquet(os.path.join(path, 'df_snv.parquet'))
+        df_oae = gpd.read_parquet(os.path.join(path, 'df_oae.parquet'))
+    except (OSError, ValueError):
+        return None
+    # Atualiza o mtime para a política de remoção por uso recente
+    os.utime(path)
+    return df_snv, df_oae
+
+
+def write_cache(key, df_snv, df_oae, cache_dir=CACHE_DIR):
+    # Grava em diretório temporário e renomeia, para que leitores concorrentes
+    # nunca vejam uma entrada incompleta
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    try:
+        df_snv.to_parquet(os.path.join(tmp_path, 'df_snv.parquet'))
+        df_oae.to_parquet(os.path.join(tmp_path, 'df_oae.parquet'))
+        os.replace(tmp_path, os.path.join(cache_dir, key))
+    except OSError:
+        # Outro processo já gravou a mesma entrada, ou o disco está indisponível
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict_cache(cache_dir)
+
+
+# Colunas lidas dos shapefiles: as usadas no pipeline e nos tooltips do mapa
+SNV_COLUMNS = ['vl_codigo', 'vl_br', 'sg_uf', 'ds_coinc', 'ds_tipo_ad', 'ds_jurisdi', 'ds_superfi', 'ul', 'versao_snv']
+UF_COLUMNS = ['SIGLA_UF']
+
+
+def input_name(uploaded_file):
+    # Nome do arquivo de entrada para as mensagens de erro
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        return os.path.basename(uploaded_file)
+    return getattr(uploaded_file, 'name', None) or 'arquivo enviado'
+
+
+def read_zipped_shapefile(uploaded_file, columns=None):
+    # Lê o shapefile direto dos bytes do ZIP: o pyogrio monta o buffer em
+    # /vsimem/ e o GDAL lê via /vsizip/, sem extrair nada para o disco.
+    # Só as colunas pedidas são lidas, em formato Arrow.
+    data = file_bytes(uploaded_file)
+    try:
+        with zipfile.ZipFile(io.BytesIO(data), 'r') as z:
+            # Encontrar o arquivo .shp dentro do ZIP
+            shp_files = [f for f in z.namelist() if f.lower().endswith('.shp')]
+            if not shp_files:
+                raise PipelineError(f"Nenhum arquivo .shp encontrado em {input_name(uploaded_file)}")
+            shp_file = shp_files[0]
+            shp_dir, shp_name = os.path.split(shp_file)
+            layer = os.path.splitext(shp_name)[0]
+            if shp_dir:
+                # O GDAL só abre shapefiles na raiz do ZIP: reempacota (sem
+                # compressão, em memória) apenas os arquivos dessa camada
+                buffer = io.BytesIO()
+                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as flat:
+                    for name in z.namelist():
+                        base = os.path.basename(name)
+                        if os.path.dirname(name) == shp_dir and os.path.splitext(base)[0] == layer:
+                            flat.writestr(base, z.read(name))
+                data = buffer.getvalue()
+        df = gpd.read_file(io.BytesIO(data), layer=layer, columns=columns, engine='pyogrio', use_arrow=True)
+    except zipfile.BadZipFile as e:
+        raise PipelineError(f"{input_name(uploaded_file)} não é um arquivo ZIP válido") from e
+    except (pyogrio.errors.DataSourceError, pyogrio.errors.DataLayerError, pyogrio.errors.FieldError) as e:
+        raise PipelineError(f"Shapefile inválido em {input_name(uploaded_file)}: {e}") from e
+    missing = [col for col in columns or [] if col not in df.columns]
+    if missing:
+        raise PipelineError(f"Colunas ausentes no shapefile {input_name(uploaded_file)}: {', '.join(missing)}")
+    return df
+
+
+# Índice espacial do SNV e das UFs, construído uma vez por versão dos dois
+# shapefiles e persistido no diretório de cache. Uma nova planilha de OAE é
+# cruzada com o índice existente sem reler nem reprojetar SNV e UF.
+SPATIAL_INDEX_FILES = ['SNV_202501A', 'BR_UF_2022']
+PROJECTED_CRS = 5880
+SNV_JOIN_DISTANCE = 250
+UF_JOIN_DISTANCE = 500
+# Resolução da grade de pré-classificação das UFs (células no lado maior)
+UF_GRID_SIZE = 128
+
+
+def build_uf_grid(uf_geoms, distance, size=UF_GRID_SIZE):
+    # Pré-classifica uma grade regular sobre as UFs. Cada célula recebe:
+    #   >= 0  índice da única UF a menos de `distance` de qualquer ponto da
+    #         célula, que contém a célula inteira (resposta exata, sem teste)
+    #   -1    nenhuma UF a menos de `distance` (resposta exata: sem UF)
+    #   -2    célula de divisa: os pontos são testados contra as UFs candidatas
+    xmin, ymin, xmax, ymax = shapely.total_bounds(uf_geoms)
+    xmin, ymin, xmax, ymax = xmin - distance, ymin - distance, xmax + distance, ymax + distance
+    cell = max(xmax - xmin, ymax - ymin) / size
+    nx = max(int(np.ceil((xmax - xmin) / cell)), 1)
+    ny = max(int(np.ceil((ymax - ymin) / cell)), 1)
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny))
+    x0 = xmin + ix.ravel() * cell
+    y0 = ymin + iy.ravel() * cell
+    cells = shapely.box(x0, y0, x0 + cell, y0 + cell)
+
+    tree = shapely.STRtree(uf_geoms)
+    cell_idx, uf_idx = tree.query(cells, predicate='dwithin', distance=distance)
+    counts = np.bincount(cell_idx, minlength=len(cells))
+    indptr = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    order = np.argsort(cell_idx, kind='stable')
+    indices = uf_idx[order]
+
+    status = np.full(len(cells), -2, dtype=np.int64)
+    status[counts == 0] = -1
+    single = np.flatnonzero(counts == 1)
+    single_uf = indices[indptr[single]]
+    inside = shapely.contains_properly(uf_geoms[single_uf], cells[single])
+    status[single[inside]] = single_uf[inside]
+
+    return {
+        'origin': np.array([xmin, ymin]), 'cell': np.array(cell), 'shape': np.array([nx, ny]),
+        'status': status, 'indptr': indptr, 'indices': indices,
+    }
+
+
+def build_spatial_index(v_snv, v_uf):
+    # Reprojeta SNV e UF para o CRS métrico e pré-classifica a grade das UFs
+    source_crs = v_snv.crs
+    v_snv = v_snv.to_crs(epsg=PROJECTED_CRS)
+    v_uf = v_uf.rename(columns={'SIGLA_UF': 'uf'}).to_crs(epsg=PROJECTED_CRS)
+    index = {
+        'source_crs': source_crs,
+        'snv': v_snv,
+        'uf': v_uf,
+        'uf_grid': build_uf_grid(np.asarray(v_uf.geometry.array), UF_JOIN_DISTANCE),
+    }
+    prepare_spatial_index(index)
+    return index
+
+
+def prepare_spatial_index(index):
+    # Estruturas em memória derivadas dos dados persistidos: a STRtree do SNV
+    # e as geometrias preparadas das UFs
+    index['snv_tree'] = shapely.STRtree(np.asarray(index['snv'].geometry.array))
+    uf_geoms = np.asarray(index['uf'].geometry.array)
+    shapely.prepare(uf_geoms)
+    index['uf_geoms'] = uf_geoms
+    index['uf_tree'] = shapely.STRtree(uf_geoms)
+    return index
+
+
+def save_spatial_index(index, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(path))
+    try:
+        index['snv'].to_parquet(os.path.join(tmp_path, 'snv.parquet'))
+        index['uf'].to_parquet(os.path.join(tmp_path, 'uf.parquet'))
+        np.savez(os.path.join(tmp_path, 'uf_grid.npz'), source_crs=np.array(index['source_crs'].to_wkt()), **index['uf_grid'])
+        os.replace(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_spatial_index(path):
+    try:
+        snv = gpd.read_parquet(os.path.join(path, 'snv.parquet'))
+        uf = gpd.read_parquet(os.path.join(path, 'uf.parquet'))
+        with np.load(os.path.join(path, 'uf_grid.npz')) as npz:
+            grid = {k: npz[k] for k in npz.files}
+    except (OSError, ValueError):
+        return None
+    os.utime(path)
+    source_crs = pyproj.CRS.from_wkt(str(grid.pop('source_crs')))
+    return prepare_spatial_index({'source_crs': source_crs, 'snv': snv, 'uf': uf, 'uf_grid': grid})
+
+
+def read_shapefile_timed(stage_name, uploaded_file, columns):
+    with stage(stage_name) as record:
+        df = read_zipped_shapefile(uploaded_file, columns=columns)
+        record['rows'] = len(df)
+    return df
+
+
+def get_spatial_index(index_key, uploaded_files, cache_dir=CACHE_DIR):
+    # Disco -> construção a partir dos shapefiles (o app guarda o resultado
+    # também na memória do processo, ver mapa.get_spatial_index)
+    path = os.path.join(cache_dir, f'index-{index_key}')
+    with stage('load_spatial_index') as record:
+        index = load_spatial_index(path)
+        record['rows'] = len(index['snv']) if index is not None else 0
+    if index is None:
+        # Os dois shapefiles são lidos em paralelo (o GDAL libera o GIL)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            snv = submit(executor, read_shapefile_timed, 'read_snv_shapefile', uploaded_files['SNV_202501A'], SNV_COLUMNS)
+            uf = submit(executor, read_shapefile_timed, 'read_uf_shapefile', uploaded_files['BR_UF_2022'], UF_COLUMNS)
+            v_snv, v_uf = snv.result(), uf.result()
+        with stage('build_spatial_index', rows=len(v_snv) + len(v_uf)):
+            index = build_spatial_index(v_snv, v_uf)
+        with stage('save_spatial_index'):
+            save_spatial_index(index, path)
+    return index
+
+
+def left_join_pairs(n_left, left, right):
+    # Completa os pares (esquerda, direita) de uma consulta espacial com as
+    # linhas da esquerda sem correspondência (direita = -1), ordenados pela esquerda
+    missing = np.setdiff1d(np.arange(n_left), left)
+    left = np.concatenate([left, missing])
+    right = np.concatenate([right, np.full(len(missing), -1, dtype=np.int64)])
+    order = np.lexsort((right, left))
+    return left[order], right[order]
+
+
+def query_snv(index, points, distance=SNV_JOIN_DISTANCE):
+    # Segmentos do SNV a até `distance` metros de cada ponto
+    left, right = index['snv_tree'].query(points, predicate='dwithin', distance=distance)
+    return left_join_pairs(len(points), left, right)
+
+
+# Consulta particionada ao SNV (ver query_snv_partitioned), fora do pipeline
+# enquanto o ganho em máquinas com vários núcleos não for medido: só o
+# benchmark a executa (bench_pipeline.py --workers N)
+PARTITIONS_PER_WORKER = 4
+
+
+def partition_points(xy, n_parts):
+    # Divide os pontos com coordenadas em ~n_parts blocos compactos e de
+    # tamanho parecido: faixas com o mesmo número de pontos em x e, dentro de
+    # cada faixa, em y. Devolve as posições de cada bloco, em ordem crescente.
+    valid = np.flatnonzero(np.isfinite(xy).all(axis=1))
+    n_strips = max(int(np.ceil(np.sqrt(n_parts))), 1)
+    parts = []
+    for strip in np.array_split(valid[np.argsort(xy[valid, 0], kind='stable')], n_strips):
+        by_y = strip[np.argsort(xy[strip, 1], kind='stable')]
+        parts.extend(np.sort(part) for part in np.array_split(by_y, n_strips) if len(part))
+    return parts
+
+
+def query_snv_block(xy, snv_wkb, snv_rows, distance):
+    # Executada no processo filho: recebe as coordenadas do bloco e só os
+    # segmentos do SNV no retângulo do bloco ampliado de `distance`, com as
+    # posições globais deles
+    tree = shapely.STRtree(shapely.from_wkb(snv_wkb))
+    left, right = tree.query(shapely.points(xy), predicate='dwithin', distance=distance)
+    return left, snv_rows[right]
+
+
+def query_snv_partitioned(index, points, workers, distance=SNV_JOIN_DISTANCE):
+    # Mesmo resultado de query_snv, com os pontos divididos em blocos
+    # espaciais consultados em `workers` processos. Cada bloco leva só os
+    # segmentos do SNV cujo retângulo toca o do bloco ampliado de `distance`
+    # (em WKB) e monta uma STRtree pequena; nenhum processo recebe o SNV
+    # inteiro. Os índices locais dos pontos voltam para as posições globais e
+    # left_join_pairs ordena os pares como na consulta serial.
+    xy = shapely.bounds(points)[:, :2]
+    blocks = partition_points(xy, workers * PARTITIONS_PER_WORKER)
+    snv_wkb = shapely.to_wkb(np.asarray(index['snv'].geometry.array))
+
+    lefts, rights = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    # 'spawn': o processo pai pode ter threads (Streamlit, pools de leitura)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = []
+        for part in blocks:
+            (xmin, ymin), (xmax, ymax) = xy[part].min(axis=0), xy[part].max(axis=0)
+            box = shapely.box(xmin - distance, ymin - distance, xmax + distance, ymax + distance)
+            snv_rows = np.sort(index['snv_tree'].query(box))
+            futures.append(executor.submit(query_snv_block, xy[part], snv_wkb[snv_rows], snv_rows, distance))
+        for part, future in zip(blocks, futures):
+            left, right = future.result()
+            lefts.append(part[left])
+            rights.append(right)
+    left = np.concatenate(lefts).astype(np.int64)
+    right = np.concatenate(rights).astype(np.int64)
+    return left_join_pairs(len(points), left, right), len(blocks)
+
+
+def query_uf(index, points, distance=UF_JOIN_DISTANCE):
+    # UFs a até `distance` metros de cada ponto. Pontos em células interiores
+    # ou vazias da grade são resolvidos sem geometria; só os pontos de divisa
+    # são testados contra as geometrias preparadas das UFs candidatas.
+    grid = index['uf_grid']
+    uf_geoms = index['uf_geoms']
+    nx, ny = grid['shape']
+    # bounds em vez de get_x/get_y: pontos vazios (sem coordenadas) viram NaN
+    xy = shapely.bounds(points)[:, :2]
+    x = (xy[:, 0] - grid['origin'][0]) / grid['cell']
+    y = (xy[:, 1] - grid['origin'][1]) / grid['cell']
+    in_grid = np.isfinite(x) & np.isfinite(y) & (x >= 0) & (y >= 0) & (x < nx) & (y < ny)
+    cell = np.full(len(points), -1, dtype=np.int64)
+    cell[in_grid] = np.floor(y[in_grid]).astype(np.int64) * nx + np.floor(x[in_grid]).astype(np.int64)
+    status = np.where(in_grid, grid['status'][cell], -2)
+
+    # Células interiores
+    interior = np.flatnonzero(status >= 0)
+    lefts, rights = [interior], [status[interior]]
+
+    # Células de divisa: pares (ponto, UF candidata) testados com dwithin
+    border = np.flatnonzero((status == -2) & in_grid)
+    starts = grid['indptr'][cell[border]]
+    counts = grid['indptr'][cell[border] + 1] - starts
+    cand_left = np.repeat(border, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cand_right = grid['indices'][np.repeat(starts, counts) + offsets]
+    hit = shapely.dwithin(uf_geoms[cand_right], points[cand_left], distance)
+    lefts.append(cand_left[hit])
+    rights.append(cand_right[hit])
+
+    # Pontos fora da grade (ou sem coordenadas): consulta direta na árvore
+    outside = np.flatnonzero(~in_grid)
+    if len(outside):
+        o_left, o_right = index['uf_tree'].query(points[outside], predicate='dwithin', distance=distance)
+        lefts.append(outside[o_left])
+        rights.append(o_right)
+
+    left = np.concatenate(lefts).astype(np.int64)
+    right = np.concatenate(rights).astype(np.int64)
+    return left_join_pairs(len(points), left, right)
+
+
+def take_rows(df, positions):
+    # df.iloc[positions] com -1 virando linha nula (como no left join)
+    return df.reset_index(drop=True).reindex(positions).reset_index(drop=True)
+
+
+# Níveis de detalhe do SNV: tolerância de simplificação (m) e coluna de
+# geometria correspondente em df_snv, do mais detalhado ao mais grosseiro
+SNV_LOD_LEVELS = [(10, 'geometry'), (100, 'geometry_100'), (1000, 'geometry_1000')]
+
+
+# Colunas de cada OAE após o passo 4, na ordem em que aparecem em df_oae
+GROUPED_COLUMNS = [
+    'descr_obra', 'br', 'uf_1', 'ul_1', 'extens_m', 'largura_m', 'tipo_estrutura', 'tipo_obra',
+    'origem_cadastro', 'latitude', 'longitude', 'uf_2', 'vl_codigo', 'ds_tipo_ad', 'ds_jurisdi', 'ul_2',
+]
+# Coordenadas e medidas: um valor por OAE (o da primeira linha do grupo; as
+# coordenadas são iguais em todo o grupo, que é agrupado pelo ponto). Medidas
+# diferentes no mesmo grupo são marcadas em 'medida_divergente'.
+NUMERIC_COLUMNS = {'extens_m': 'float64', 'largura_m': 'float64', 'latitude': 'float64', 'longitude': 'float64'}
+MEASUREMENT_COLUMNS = ['extens_m', 'largura_m']
+COORDINATE_COLUMNS = ['latitude', 'longitude']
+# Demais colunas: valores distintos unidos por ';'
+AGG_COLUMNS = [col for col in GROUPED_COLUMNS if col not in NUMERIC_COLUMNS]
+# Colunas de baixa cardinalidade guardadas como categóricas (os valores com
+# ';' também se repetem pouco: são combinações das mesmas categorias)
+CATEGORY_COLUMNS = ['ds_tipo_ad', 'ds_jurisdi', 'uf_2', 'ul_2', 'tipo_obra', 'nota_sgo']
+
+
+def multi_valued(series, sep=';'):
+    # Linhas com mais de um valor distinto. Em colunas categóricas o teste é
+    # feito uma vez por categoria e levado às linhas pelos códigos.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        per_category = np.append(series.cat.categories.astype(str).str.contains(sep, regex=False), False)
+        return per_category[series.cat.codes.to_numpy()]
+    return series.str.contains(sep, regex=False, na=False).to_numpy()
+
+
+def parse_numeric(values, name):
+    # Converte a coluna para número aceitando vírgula decimal ('12,5' e
+    # '1.234,5'). Textos que não são números viram NaN e são registrados no
+    # log, com a contagem e alguns exemplos.
+    if values.dtype == object:
+        text = values.astype(str).str.strip()
+        has_comma = text.str.contains(',', regex=False)
+        text = text.where(~has_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        numbers = pd.to_numeric(text.where(values.notna()), errors='coerce')
+    else:
+        numbers = pd.to_numeric(values, errors='coerce')
+    invalid = numbers.isna() & values.notna()
+    if invalid.any():
+        examples = ', '.join(repr(v) for v in values[invalid].drop_duplicates().head(5))
+        logger.warning('%s: %d valores não numéricos ignorados (ex.: %s)', name, int(invalid.sum()), examples)
+    return numbers
+
+
+def aggregate_distinct(group_ids, df, columns, n_groups, sep=';'):
+    # Equivalente vetorizado de
+    #   df.groupby(group_ids).agg({col: lambda x: sep.join(sorted(set(x.dropna().astype(str))))})
+    # para todas as colunas de uma vez. Cada valor vira um código inteiro
+    # (factorize ordenado), os pares (grupo, código) são deduplicados e
+    # ordenados como inteiros, e as strings de cada grupo são concatenadas em
+    # bloco com np.add.reduceat. Grupos sem valores resultam em ''.
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    value_groups, value_codes, labels, label_columns = [], [], [], []
+    offset = 0
+    for i, col in enumerate(columns):
+        values = df[col]
+        notna = values.notna().to_numpy()
+        codes, uniques = pd.factorize(values[notna].astype(str), sort=True)
+        value_groups.append(group_ids[notna])
+        value_codes.append(codes + offset)
+        labels.append(np.asarray(uniques, dtype=object))
+        label_columns.append(np.full(len(uniques), i))
+        offset += len(uniques)
+
+    labels = np.concatenate(labels) if labels else np.array([], dtype=object)
+    label_columns = np.concatenate(label_columns) if label_columns else np.array([], dtype=int)
+    result = {col: np.full(n_groups, '', dtype=object) for col in columns}
+    if offset == 0:
+        return pd.DataFrame(result)
+
+    # Chave única por (grupo, valor); o código do valor já identifica a coluna
+    keys = np.unique(np.concatenate(value_groups) * offset + np.concatenate(value_codes))
+    groups = keys // offset
+    codes = keys % offset
+    cols = label_columns[codes]
+
+    # Ordena por coluna, grupo e valor, e marca o início de cada bloco (coluna, grupo)
+    order = np.lexsort((codes, groups, cols))
+    groups, codes, cols = groups[order], codes[order], cols[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = (groups[1:] != groups[:-1]) | (cols[1:] != cols[:-1])
+    labels_sep = np.array([sep + label for label in labels], dtype=object)
+    pieces = np.where(starts, labels[codes], labels_sep[codes])
+    start_idx = np.flatnonzero(starts)
+    joined = np.add.reduceat(pieces, start_idx)
+
+    start_cols = cols[start_idx]
+    start_groups = groups[start_idx]
+    for i, col in enumerate(columns):
+        sel = start_cols == i
+        result[col][start_groups[sel]] = joined[sel]
+    return pd.DataFrame(result)
+
+
+# Colunas lidas da planilha de OAEs e do relatório do SGO (as demais não
+# chegam a df_oae e não são convertidas)
+OAE_COLUMNS = [
+    'cod_sgo', 'descr_obra', 'br', 'uf', 'ul', 'extens_m', 'largura_m', 'tipo_estrutura',
+    'tipo_obra', 'origem_cadastro', 'latitude', 'longitude',
+]
+SGO_COLUMNS = ['Código', 'PNV', 'Nota']
+
+
+def excel_cell(value):
+    # Mesma conversão de célula do pd.read_excel com openpyxl: vazia -> '',
+    # número inteiro em float -> int
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def read_oae_base(file):
+    # Leitura em streaming (openpyxl somente leitura, só os valores) das
+    # colunas de OAE_COLUMNS. A inferência de tipos e os valores nulos são os
+    # do pd.read_excel (TextParser), sem criar objetos de célula.
+    with stage('read_excel') as record:
+        workbook = openpyxl.load_workbook(io.BytesIO(file_bytes(file)), read_only=True, data_only=True, keep_links=False)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = list(next(rows, ()))
+            missing = [col for col in OAE_COLUMNS if col not in header]
+            if missing:
+                raise PipelineError(f"Colunas ausentes na base OAE: {', '.join(missing)}")
+            positions = [header.index(col) for col in OAE_COLUMNS]
+            data = [OAE_COLUMNS]
+            for row in rows:
+                data.append([excel_cell(row[i]) if i < len(row) else '' for i in positions])
+        finally:
+            workbook.close()
+        # Linhas vazias no fim da planilha são descartadas, como no pd.read_excel
+        while len(data) > 1 and all(value == '' for value in data[-1]):
+            data.pop()
+        df = TextParser(data, header=0).read()
+        record['rows'] = len(df)
+    return df
+
+
+def read_sgo(file):
+    # Leitor CSV do Arrow (multithread, fora do GIL) só com as colunas de
+    # SGO_COLUMNS, todas como texto; campos vazios viram nulos (NaN)
+    with stage('read_sgo_csv') as record:
+        try:
+            table = pa_csv.read_csv(
+                pa.BufferReader(file_bytes(file)),
+                read_options=pa_csv.ReadOptions(encoding='latin1'),
+                parse_options=pa_csv.ParseOptions(delimiter=';'),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=SGO_COLUMNS,
+                    column_types={col: pa.string() for col in SGO_COLUMNS},
+                    strings_can_be_null=True,
+                ),
+            )
+        except (pa.ArrowInvalid, KeyError) as e:
+            raise PipelineError(f"Relatório SGO inválido: {e}") from e
+        df = table.to_pandas()
+        df = df.where(df.notna(), np.nan)
+        record['rows'] = len(df)
+    return df
+
+
+def project_oae(v_oae_v2, crs):
+    # Pontos das OAEs (longitude/latitude no CRS de origem) no CRS métrico.
+    # As coordenadas são convertidas aqui (com vírgula decimal, ver
+    # parse_numeric) e seguem como float64 até o agrupamento.
+    v_oae_v2 = v_oae_v2.copy()
+    for col in COORDINATE_COLUMNS:
+        v_oae_v2[col] = parse_numeric(v_oae_v2[col], col).astype('float64')
+    geometry = gpd.points_from_xy(v_oae_v2['longitude'], v_oae_v2['latitude'], crs=crs)
+    v_oae_v2 = gpd.GeoDataFrame(v_oae_v2, geometry=geometry, crs=crs)
+    return v_oae_v2.to_crs(epsg=PROJECTED_CRS)
+
+
+def join_oae(v_oae_v2, index):
+    # Spatial join com buffer de 250m (ST_DWithin) e, depois, com as UFs a
+    # 500m. Equivale aos dois gpd.sjoin(how='left', predicate='dwithin'):
+    # uma linha por combinação (OAE, segmento SNV, UF).
+    points = np.asarray(v_oae_v2.geometry.array)
+    colunas_snv = ['vl_codigo', 'ds_tipo_ad', 'ds_jurisdi','ul','versao_snv']
+
+    with stage('sjoin_snv') as record:
+        snv_left, snv_right = query_snv(index, points)
+        record['rows'] = len(snv_left)
+    with stage('sjoin_uf') as record:
+        uf_left, uf_right = query_uf(index, points)
+        record['rows'] = len(uf_left)
+    pairs = pd.merge(
+        pd.DataFrame({'oae': snv_left, 'snv': snv_right}),
+        pd.DataFrame({'oae': uf_left, 'uf': uf_right}),
+        on='oae',
+    )
+    df_merged = pd.concat([
+        v_oae_v2.iloc[pairs['oae']].reset_index(drop=True).rename(columns={'uf': 'uf_1', 'ul': 'ul_1'}),
+        take_rows(index['snv'][colunas_snv], pairs['snv']).rename(columns={'ul': 'ul_2'}),
+        take_rows(index['uf'][['uf']], pairs['uf']).rename(columns={'uf': 'uf_2'}),
+    ], axis=1)
+    df_merged = gpd.GeoDataFrame(df_merged, geometry='geometry', crs=v_oae_v2.crs)
+    df_merged['cod_sgo'] = df_merged['cod_sgo'].astype(str).str.zfill(6)
+    df_merged['br'] = df_merged['br'].astype(str).str.zfill(3)
+    return df_merged
+
+
+def group_oae(df_merged):
+    # Agrupamento similar ao CTE1
+    # Agrupa por chaves inteiras (cod_sgo + coordenadas do ponto) em vez de
+    # fazer hash da geometria, e junta os valores distintos de todas as colunas
+    # de uma vez (ver aggregate_distinct)
+    geometry = df_merged.geometry
+    group_keys = pd.DataFrame({
+        'cod_sgo': df_merged['cod_sgo'].to_numpy(),
+        'x': geometry.x.to_numpy(),
+        'y': geometry.y.to_numpy(),
+    })
+    group_ids = group_keys.groupby(['cod_sgo', 'x', 'y'], sort=False, dropna=False).ngroup().to_numpy()
+    _, first_rows = np.unique(group_ids, return_index=True)
+
+    aggregated = aggregate_distinct(group_ids, df_merged, AGG_COLUMNS, len(first_rows))
+    divergent = np.zeros(len(first_rows), dtype=bool)
+    for col in COORDINATE_COLUMNS:
+        # Já convertidas em project_oae
+        aggregated[col] = df_merged[col].to_numpy(dtype=NUMERIC_COLUMNS[col])[first_rows]
+    for col in MEASUREMENT_COLUMNS:
+        numbers = parse_numeric(df_merged[col], col)
+        aggregated[col] = numbers.iloc[first_rows].to_numpy(dtype=NUMERIC_COLUMNS[col])
+        distinct = numbers.groupby(group_ids).nunique()
+        divergent |= distinct.reindex(range(len(first_rows)), fill_value=0).to_numpy() > 1
+    if divergent.any():
+        logger.warning('%d OAEs com medidas diferentes entre linhas duplicadas (mantido o primeiro valor; '
+                       'ver medida_divergente)', int(divergent.sum()))
+    # Valores vazios ou sem preenchimento
+    aggregated['tipo_obra'] = aggregated['tipo_obra'].replace('', '-')
+    aggregated['ds_tipo_ad'] = aggregated['ds_tipo_ad'].replace('', None)
+
+    df_grouped = pd.concat([
+        df_merged[['cod_sgo', 'geometry']].iloc[first_rows].reset_index(drop=True),
+        aggregated[GROUPED_COLUMNS],
+    ], axis=1)
+    # Número de segmentos do SNV candidatos (a até 250 m) de cada OAE
+    candidates = df_merged['vl_codigo'].groupby(group_ids).nunique()
+    df_grouped['n_candidatos'] = candidates.reindex(range(len(first_rows)), fill_value=0).to_numpy(dtype='int16')
+    df_grouped['medida_divergente'] = divergent
+    for col in CATEGORY_COLUMNS:
+        if col in df_grouped:
+            df_grouped[col] = df_grouped[col].astype('category')
+    # Mesma ordem de linhas do groupby(['cod_sgo', 'geometry']) original
+    return df_grouped.sort_values(['cod_sgo', 'geometry'], kind='stable').reset_index(drop=True)
+
+
+def merge_sgo(df_grouped, v_oae_sgo):
+    # Join com v_oae_sgo
+    v_oae_sgo = v_oae_sgo[['Código', 'PNV', 'Nota']].copy()
+    v_oae_sgo['Código'] = v_oae_sgo['Código'].astype(str).str.zfill(6)
+    df_grouped = df_grouped.copy()
+    df_grouped['cod_sgo'] = df_grouped['cod_sgo'].astype(str).str.zfill(6)
+
+    df_merged = pd.merge(df_grouped, v_oae_sgo, left_on='cod_sgo', right_on='Código', how='left')
+    df_merged = df_merged.rename(columns={'Nota': 'nota_sgo', 'PNV': 'sgo_pnv'})
+    del df_merged['Código']
+    df_merged['nota_sgo'] = df_merged['nota_sgo'].fillna('Sem nota').astype('category')
+    return df_merged
+
+
+# Regras de conflito: rótulo usado em tipo_conflito e função que recebe o
+# DataFrame das OAEs e devolve um array booleano (uma posição por OAE). Uma
+# regra nova é só mais uma entrada na lista, sem outra passada linha a linha.
+def multi_valued_rule(column):
+    # Mais de um valor distinto de `column` entre os candidatos da OAE
+    return lambda df: multi_valued(df[column])
+
+
+CONFLICT_RULES = [
+    ('Divisa', multi_valued_rule('uf_2')),
+    ('Administração', multi_valued_rule('ds_tipo_ad')),
+    ('Jurisdição', multi_valued_rule('ds_jurisdi')),
+    ('UnidadeLocal', multi_valued_rule('ul_2')),
+]
+
+
+def classify_conflicts(df, rules=CONFLICT_RULES):
+    # Avalia todas as regras como arrays booleanos e monta 'conflitos'
+    # (Sim/Não) e 'tipo_conflito' (rótulos das regras violadas unidos por
+    # '; ', nulo sem conflito). Cada combinação de regras vira um inteiro
+    # (bit i = regra i) e o rótulo é montado uma vez por combinação.
+    flags = np.zeros((len(df), len(rules)), dtype=bool)
+    for i, (_, rule) in enumerate(rules):
+        flags[:, i] = rule(df)
+    combos, inverse = np.unique(flags @ (1 << np.arange(len(rules))), return_inverse=True)
+    labels = np.array([
+        '; '.join(label for i, (label, _) in enumerate(rules) if combo >> i & 1) or None
+        for combo in combos
+    ], dtype=object)
+    conflitos = np.where(flags.any(axis=1), 'Sim', 'Não')
+    return pd.DataFrame({
+        'conflitos': pd.Categorical(conflitos),
+        'tipo_conflito': pd.Categorical(labels[inverse.reshape(-1)]),
+    }, index=df.index)
+
+
+def flag_conflicts(df_merged, rules=CONFLICT_RULES):
+    # Calculando conflitos
+    df_merged = pd.concat([df_merged, classify_conflicts(df_merged, rules)], axis=1)
+    df_merged.rename(columns={
+        'uf_1': 'uf',
+        'ul_1': 'ul' 
+        }, inplace=True)
+    return df_merged
+
+
+def merge_pnv(df_merged, v_snv_2025):
+    # Join df_final com v_snv_2025 novamente para trazer campos do PNV
+    df_final = pd.merge(df_merged, v_snv_2025[['vl_codigo', 'ds_tipo_ad', 'ds_jurisdi', 'ul']], left_on='sgo_pnv', right_on='vl_codigo', how='left', suffixes=('','_pnv'))
+    return gpd.GeoDataFrame(df_final, geometry='geometry')
+
+
+def build_snv_lod(v_snv_2025):
+    # Simplificar geometria, em vários níveis de detalhe (ver SNV_LOD_LEVELS)
+    df_snv = v_snv_2025.copy()
+    for tolerance, column in SNV_LOD_LEVELS:
+        df_snv[column] = v_snv_2025.geometry.simplify(tolerance=tolerance, preserve_topology=True)
+    return df_snv
+
+
+def finalize_oae(df_oae):
+    # Criação da Coluna 'streetview_link'
+    df_oae = df_oae.copy()
+    df_oae['streetview_link'] = (
+        'https://www.google.com/maps?q=&layer=c&cbll='
+        + df_oae['latitude'].astype(str) + ',' + df_oae['longitude'].astype(str)
+    )
+    return df_oae
+
+
+# Threads da leitura das entradas: a thread principal (índice espacial) e
+# as da planilha e do CSV
+INGEST_WORKERS = 3
+
+
+def process_data(uploaded_files, spatial_index=get_spatial_index, workers=INGEST_WORKERS):
+    # Cada passo numerado é medido por stage(); os registros vão para o
+    # StageRecorder ativo de quem chamou (ver load_dataset)
+    # 1. Carregando os dados dos arquivos enviados. Os quatro arquivos são
+    # lidos ao mesmo tempo: a planilha e o CSV em threads deste pool e os dois
+    # shapefiles dentro do índice espacial (ver get_spatial_index), de modo
+    # que a leitura leva o tempo do arquivo mais lento.
+    with ThreadPoolExecutor(max_workers=max(min(workers, INGEST_WORKERS) - 1, 1)) as executor:
+        excel = submit(executor, read_oae_base, uploaded_files['base_oae_colep'])
+        csv = submit(executor, read_sgo, uploaded_files['23012025_relatoriosEmLote'])
+
+        # SNV e BR_UF já reprojetados, via índice espacial (reaproveitado
+        # enquanto os dois shapefiles não mudarem)
+        index_key = hash_uploaded_files(uploaded_files, SPATIAL_INDEX_FILES)
+        with stage('spatial_index') as record:
+            index = spatial_index(index_key, uploaded_files)
+            record['rows'] = len(index['snv'])
+        v_oae_v2 = excel.result()
+        v_oae_sgo = csv.result()
+
+    # 2. Reprojeção das OAEs
+    with stage('reproject_oae', rows=len(v_oae_v2)):
+        v_oae_v2 = project_oae(v_oae_v2, index['source_crs'])
+
+    # 3. Spatial join com o SNV (250m) e as UFs (500m)
+    with stage('join') as record:
+        df_merged = join_oae(v_oae_v2, index)
+        record['rows'] = len(df_merged)
+
+    # 4. Agrupamento similar ao CTE1
+    with stage('groupby') as record:
+        df_grouped = group_oae(df_merged)
+        record['rows'] = len(df_grouped)
+
+    # 5. Join com v_oae_sgo
+    with stage('merge_sgo') as record:
+        df_merged = merge_sgo(df_grouped, v_oae_sgo)
+        record['rows'] = len(df_merged)
+
+    # 6. Calculando conflitos (conflitos e tipo_conflito, ver CONFLICT_RULES)
+    with stage('conflicts', rows=len(df_merged)):
+        df_merged = flag_conflicts(df_merged)
+
+    # 7. Join df_final com v_snv_2025 novamente para trazer campos do PNV
+    with stage('merge_pnv') as record:
+        df_oae = merge_pnv(df_merged, index['snv'])
+        record['rows'] = len(df_oae)
+    with stage('snv_lod', rows=len(index['snv'])):
+        df_snv = build_snv_lod(index['snv'])
+
+    # 8. Link do Street View
+    with stage('finalize', rows=len(df_oae)):
+        df_oae = finalize_oae(df_oae)
+
+    return df_snv, df_oae
+
+
+def check_inputs(uploaded_files):
+    # Verificar se todos os arquivos necessários foram informados
+    for file in REQUIRED_FILES:
+        if file not in uploaded_files:
+            raise PipelineError(f"Arquivo obrigatório não encontrado: {file}")
+
+
+def load_dataset(uploaded_files, cache_dir=CACHE_DIR, spatial_index=None, workers=INGEST_WORKERS):
+    # Cache em disco -> processamento completo. Devolve df_snv e df_oae com a
+    # chave do dataset em attrs['dataset_key'], usada pelos caches derivados,
+    # e os registros das etapas em attrs['stage_timings'].
+    check_inputs(uploaded_files)
+    if spatial_index is None:
+        spatial_index = functools.partial(get_spatial_index, cache_dir=cache_dir)
+    cache_key = hash_uploaded_files(uploaded_files)
+    with StageRecorder() as recorder:
+        with stage('load_dataset', dataset_key=cache_key[:12]) as total:
+            with stage('read_cache'):
+                cached = read_cache(cache_key, cache_dir)
+            if cached is not None:
+                df_snv, df_oae = cached
+            else:
+                df_snv, df_oae = process_data(uploaded_files, spatial_index=spatial_index, workers=workers)
+                with stage('write_cache'):
+                    write_cache(cache_key, df_snv, df_oae, cache_dir)
+            total['cached'] = cached is not None
+            total['rows'] = len(df_oae)
+    logger.info('dataset %s %s em %.1f s', cache_key[:12],
+                'lido do cache' if cached is not None else 'processado', total['seconds'])
+
+    df_snv.attrs['dataset_key'] = cache_key
+    df_oae.attrs['dataset_key'] = cache_key
+    df_oae.attrs['stage_timings'] = recorder.records
+    return df_snv, df_oae
+
+
+# Saída do modo em lote: mesmos arquivos de uma entrada do cache, gravados num
+# subdiretório novo a cada execução (dataset-<chave>-<data>), e dataset.json
+# apontando para ele. O dataset.json é trocado atomicamente depois que os
+# arquivos estão completos, de modo que um leitor sempre vê df_snv e df_oae da
+# mesma execução. Os subdiretórios anteriores ao último são removidos.
+OUTPUT_FORMATS = ['parquet', 'csv']
+OUTPUT_KEEP = 2
+
+
+def write_outputs(df_snv, df_oae, output_dir, formats=('parquet',)):
+    os.makedirs(output_dir, exist_ok=True)
+    dataset_key = df_oae.attrs.get('dataset_key') or ''
+    tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=output_dir)
+    try:
+        if 'parquet' in formats:
+            df_snv.to_parquet(os.path.join(tmp_path, 'df_snv.parquet'))
+            df_oae.to_parquet(os.path.join(tmp_path, 'df_oae.parquet'))
+        if 'csv' in formats:
+            # CSV com a geometria em WKT (EPSG:5880); os níveis de detalhe do SNV
+            # ficam só no GeoParquet
+            lod_columns = [column for _, column in SNV_LOD_LEVELS if column != 'geometry']
+            df_snv.drop(columns=lod_columns).to_csv(os.path.join(tmp_path, 'df_snv.csv'), index=False)
+            df_oae.to_csv(os.path.join(tmp_path, 'df_oae.csv'), index=False)
+        data_dir = f"dataset-{dataset_key[:12]}-{time.strftime('%Y%m%dT%H%M%S')}-{os.path.basename(tmp_path)[5:]}"
+        os.replace(tmp_path, os.path.join(output_dir, data_dir))
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    fd, tmp_meta = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=output_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({
+            'dataset_key': dataset_key,
+            'pipeline_version': PIPELINE_VERSION,
+            'data_dir': data_dir,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'oae_rows': len(df_oae),
+            'snv_rows': len(df_snv),
+        }, f, indent=2)
+    os.replace(tmp_meta, os.path.join(output_dir, 'dataset.json'))
+
+    # Mantém o subdiretório atual e o anterior (pode estar sendo lido)
+    previous = sorted(
+        (os.path.getmtime(os.path.join(output_dir, name)), name)
+        for name in os.listdir(output_dir)
+        if name.startswith('dataset-') and name != data_dir
+    )
+    for _, name in previous[:max(len(previous) - (OUTPUT_KEEP - 1), 0)]:
+        shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+
+
+def read_outputs_meta(output_dir):
+    # Conteúdo do dataset.json da saída (chave do dataset e subdiretório dos
+    # arquivos); None se ausente ou de outra versão do pipeline
+    try:
+        with open(os.path.join(output_dir, 'dataset.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('pipeline_version') != PIPELINE_VERSION:
+        return None
+    return meta
+
+
+def read_outputs(output_dir, meta=None):
+    # Lê a saída de write_outputs; None se estiver ausente, incompleta ou
+    # gerada por outra versão do pipeline
+    meta = meta or read_outputs_meta(output_dir)
+    if meta is None:
+        return None
+    data_dir = os.path.join(output_dir, meta.get('data_dir', ''))
+    try:
+        df_snv = gpd.read_parquet(os.path.join(data_dir, 'df_snv.parquet'))
+        df_oae = gpd.read_parquet(os.path.join(data_dir, 'df_oae.parquet'))
+    except (OSError, ValueError):
+        return None
+    df_snv.attrs['dataset_key'] = meta['dataset_key']
+    df_oae.attrs['dataset_key'] = meta['dataset_key']
+    return df_snv, df_oae
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Processa as bases de OAE e grava df_oae/df_snv.')
+    parser.add_argument('--base-oae', required=True, help='Base OAE (Excel)')
+    parser.add_argument('--snv', required=True, help='Shapefile SNV (ZIP)')
+    parser.add_argument('--sgo', required=True, help='Relatório SGO (CSV)')
+    parser.add_argument('--uf', required=True, help='Shapefile BR_UF (ZIP)')
+    parser.add_argument('--output', required=True, help='Diretório de saída')
+    parser.add_argument('--format', action='append', choices=OUTPUT_FORMATS, dest='formats',
+                        help='Formato de saída (pode ser repetido; padrão: parquet)')
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help=f'Threads usadas na leitura das entradas (padrão: {INGEST_WORKERS})')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Diretório do cache em disco')
+    parser.add_argument('--no-cache', action='store_true', help='Ignora o cache do dataset e reprocessa')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    inputs = {
+        'base_oae_colep': args.base_oae,
+        'SNV_202501A': args.snv,
+        '23012025_relatoriosEmLote': args.sgo,
+        'BR_UF_2022': args.uf,
+    }
+    try:
+        for key, path in inputs.items():
+            if not os.path.isfile(path):
+                raise PipelineError(f"Arquivo de entrada não encontrado ({key}): {path}")
+        if args.no_cache:
+            spatial_index = functools.partial(get_spatial_index, cache_dir=args.cache_dir)
+            df_snv, df_oae = process_data(inputs, spatial_index=spatial_index, workers=args.workers)
+            key = hash_uploaded_files(inputs)
+            df_snv.attrs['dataset_key'] = key
+            df_oae.attrs['dataset_key'] = key
+        else:
+            df_snv, df_oae = load_dataset(inputs, cache_dir=args.cache_dir, workers=args.workers)
+        write_outputs(df_snv, df_oae, args.output, args.formats or ['parquet'])
+    except PipelineError as e:
+        logger.error('%s', e)
+        return 2
+    except Exception:
+        logger.exception('Erro ao processar os arquivos')
+        return 1
+    logger.info('%d OAEs e %d segmentos SNV gravados em %s', len(df_oae), len(df_snv), args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
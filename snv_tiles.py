@@ -0,0 +1,285 @@
+# Vector tiles (Mapbox Vector Tile) do SNV: geração de um arquivo MBTiles e
+# servidor HTTP local que entrega os tiles para o Leaflet.VectorGrid.
+#
+# O codificador MVT é mínimo (só linhas e propriedades texto), escrito direto
+# sobre o formato protobuf para não depender de bibliotecas extras.
+import gzip
+import http.server
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+import shapely
+
+# Extensão das coordenadas dentro do tile e margem (em unidades do tile) usada
+# no recorte, para evitar emendas visíveis entre tiles vizinhos
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+LAYER_NAME = 'snv'
+
+# Limites do Web Mercator (EPSG:3857)
+WEB_MERCATOR_MAX = 20037508.342789244
+
+
+# --- Protobuf ---------------------------------------------------------------
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_varints(values):
+    # Codifica um array de inteiros sem sinal como varints concatenados
+    # (vetorizado com numpy; listas curtas vão direto em Python)
+    if len(values) < 64:
+        return b''.join(encode_varint(int(v)) for v in values)
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(values.size, dtype=np.int64)
+    k = 1
+    while k < 10 and (values >= (np.uint64(1) << np.uint64(7 * k))).any():
+        n_bytes += values >= (np.uint64(1) << np.uint64(7 * k))
+        k += 1
+    width = int(n_bytes.max())
+    shifts = np.arange(width, dtype=np.uint64) * np.uint64(7)
+    chunks = ((values[:, None] >> shifts) & np.uint64(0x7f)).astype(np.uint8)
+    positions = np.arange(width)
+    chunks[positions < (n_bytes[:, None] - 1)] |= 0x80
+    return chunks[positions < n_bytes[:, None]].tobytes()
+
+
+def field_key(number, wire_type):
+    return encode_varint((number << 3) | wire_type)
+
+
+def field_bytes(number, payload):
+    return field_key(number, 2) + encode_varint(len(payload)) + payload
+
+
+def zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+# --- Codificação MVT --------------------------------------------------------
+
+def encode_line_geometry(parts):
+    # Comandos MVT (MoveTo/LineTo, deltas em zigzag) para uma lista de linhas
+    # em coordenadas inteiras do tile
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for coords in parts:
+        deltas = np.diff(np.vstack([cursor, coords]), axis=0)
+        cursor = coords[-1]
+        commands.append(np.array([(1 & 0x7) | (1 << 3)], dtype=np.uint64))
+        commands.append(zigzag(deltas[0]))
+        commands.append(np.array([(2 & 0x7) | ((len(coords) - 1) << 3)], dtype=np.uint64))
+        commands.append(zigzag(deltas[1:].ravel()))
+    return encode_varints(np.concatenate(commands))
+
+
+def encode_layer(name, features, extent=TILE_EXTENT):
+    # features: lista de (partes, propriedades); propriedades com valores texto
+    keys, values = {}, {}
+    encoded = []
+    for parts, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(str(value), len(values)))
+        feature = field_bytes(2, encode_varints(tags))
+        feature += field_key(3, 0) + encode_varint(2)  # GeomType LINESTRING
+        feature += field_bytes(4, encode_line_geometry(parts))
+        encoded.append(field_bytes(2, feature))
+
+    layer = field_key(15, 0) + encode_varint(2)
+    layer += field_bytes(1, name.encode())
+    layer += b''.join(encoded)
+    layer += b''.join(field_bytes(3, key.encode()) for key in keys)
+    layer += b''.join(field_bytes(4, field_bytes(1, value.encode())) for value in values)
+    layer += field_key(5, 0) + encode_varint(extent)
+    return field_bytes(3, layer)
+
+
+# --- Geometria dos tiles ----------------------------------------------------
+
+def tile_bounds(z, x, y):
+    size = 2 * WEB_MERCATOR_MAX / 2 ** z
+    xmin = -WEB_MERCATOR_MAX + x * size
+    ymax = WEB_MERCATOR_MAX - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tile_ranges(bounds, z):
+    # Intervalo de tiles (x0, x1, y0, y1) coberto por cada retângulo envolvente
+    n = 2 ** z
+    size = 2 * WEB_MERCATOR_MAX / n
+    x0 = np.floor((bounds[:, 0] + WEB_MERCATOR_MAX) / size)
+    x1 = np.floor((bounds[:, 2] + WEB_MERCATOR_MAX) / size)
+    y0 = np.floor((WEB_MERCATOR_MAX - bounds[:, 3]) / size)
+    y1 = np.floor((WEB_MERCATOR_MAX - bounds[:, 1]) / size)
+    return [np.clip(v, 0, n - 1).astype(np.int64) for v in (x0, x1, y0, y1)]
+
+
+def feature_tiles(bounds, z):
+    # Pares (feição, tile) cujo retângulo envolvente toca o tile
+    valid = np.isfinite(bounds).all(axis=1)
+    index = np.flatnonzero(valid)
+    x0, x1, y0, y1 = tile_ranges(bounds[valid], z)
+    nx, ny = x1 - x0 + 1, y1 - y0 + 1
+    counts = nx * ny
+    feature = np.repeat(index, counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tx = np.repeat(x0, counts) + offset % np.repeat(nx, counts)
+    ty = np.repeat(y0, counts) + offset // np.repeat(nx, counts)
+    return feature, tx, ty
+
+
+def tile_features(geoms, z, x, y, extent=TILE_EXTENT, buffer=TILE_BUFFER):
+    # Recorta as geometrias no tile (com margem) e converte para coordenadas
+    # inteiras do tile. Devolve, por geometria, a lista de partes não vazias.
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    scale = extent / (xmax - xmin)
+    margin = buffer / scale
+    clipped = shapely.clip_by_rect(geoms, xmin - margin, ymin - margin, xmax + margin, ymax + margin)
+    parts, part_owner = shapely.get_parts(clipped, return_index=True)
+    is_line = shapely.get_type_id(parts) == 1
+    parts, part_owner = parts[is_line], part_owner[is_line]
+    coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+    px = np.round((coords[:, 0] - xmin) * scale).astype(np.int64)
+    py = np.round((ymax - coords[:, 1]) * scale).astype(np.int64)
+    tile_coords = np.column_stack([px, py])
+
+    result = [[] for _ in range(len(geoms))]
+    splits = np.flatnonzero(np.diff(coord_part)) + 1
+    for owner, part in zip(part_owner[np.unique(coord_part)], np.split(tile_coords, splits)):
+        # Remove vértices repetidos após o arredondamento
+        keep = np.ones(len(part), dtype=bool)
+        keep[1:] = (np.diff(part, axis=0) != 0).any(axis=1)
+        part = part[keep]
+        if len(part) >= 2:
+            result[owner].append(part)
+    return result
+
+
+def meters_per_pixel(z):
+    return 2 * WEB_MERCATOR_MAX / (256 * 2 ** z)
+
+
+def build_mbtiles(geometry_levels, properties, path, minzoom=4, maxzoom=12, name='SNV'):
+    # Gera o MBTiles do SNV.
+    #   geometry_levels: lista de (tolerância em metros, GeoSeries em qualquer
+    #                    CRS), do mais detalhado ao mais grosseiro; cada zoom
+    #                    usa o nível mais grosseiro cuja tolerância não passa
+    #                    do tamanho de um pixel
+    #   properties:      DataFrame alinhado com as geometrias (valores texto)
+    levels = [(tol, np.asarray(geoms.to_crs(epsg=3857).array)) for tol, geoms in geometry_levels]
+    records = properties.astype(object).where(properties.notna(), None).to_dict('records')
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        conn.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        for z in range(minzoom, maxzoom + 1):
+            geoms = levels[0][1]
+            for tolerance, level_geoms in levels:
+                if tolerance <= meters_per_pixel(z):
+                    geoms = level_geoms
+            feature, tx, ty = feature_tiles(shapely.bounds(geoms), z)
+            order = np.lexsort((feature, ty, tx))
+            feature, tx, ty = feature[order], tx[order], ty[order]
+            starts = np.flatnonzero(np.r_[True, (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])])
+            rows = []
+            for chunk in np.split(np.arange(len(feature)), starts[1:]):
+                if not len(chunk):
+                    continue
+                x, y = int(tx[chunk[0]]), int(ty[chunk[0]])
+                ids = feature[chunk]
+                parts = tile_features(geoms[ids], z, x, y)
+                layer_features = [(p, records[i]) for i, p in zip(ids, parts) if p]
+                if not layer_features:
+                    continue
+                data = gzip.compress(encode_layer(LAYER_NAME, layer_features))
+                # MBTiles usa o esquema TMS (linha 0 embaixo)
+                rows.append((z, x, 2 ** z - 1 - y, data))
+            conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+
+        lon_lat = geometry_levels[0][1].to_crs(epsg=4326).total_bounds
+        metadata = {
+            'name': name, 'format': 'pbf', 'type': 'overlay',
+            'minzoom': str(minzoom), 'maxzoom': str(maxzoom),
+            'bounds': ','.join(f'{v:.6f}' for v in lon_lat),
+            'json': json.dumps({'vector_layers': [{
+                'id': LAYER_NAME, 'minzoom': minzoom, 'maxzoom': maxzoom,
+                'fields': {col: 'String' for col in properties.columns},
+            }]}),
+        }
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+        conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+# --- Servidor de tiles ------------------------------------------------------
+
+class TileRequestHandler(http.server.BaseHTTPRequestHandler):
+    # GET /<chave>/<z>/<x>/<y>.pbf -> tile do arquivo <raiz>/tiles-<chave>/snv.mbtiles
+    path_pattern = re.compile(r'^/([0-9a-f]+)/(\d+)/(\d+)/(\d+)\.pbf$')
+
+    def do_GET(self):
+        match = self.path_pattern.match(self.path.split('?')[0])
+        if not match:
+            self.send_error(404)
+            return
+        key, z, x, y = match.group(1), *map(int, match.groups()[1:])
+        mbtiles = os.path.join(self.server.tiles_root, f'tiles-{key}', 'snv.mbtiles')
+        if not os.path.exists(mbtiles):
+            self.send_error(404)
+            return
+        conn = sqlite3.connect(f'file:{mbtiles}?mode=ro', uri=True)
+        try:
+            row = conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (z, x, 2 ** z - 1 - y),
+            ).fetchone()
+        finally:
+            conn.close()
+
+        # Tile sem feições: resposta vazia (tile MVT válido sem camadas)
+        data = row[0] if row else b''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        if data:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # A chave do dataset faz parte da URL, então o tile nunca muda
+        self.send_header('Cache-Control', 'public, max-age=604800, immutable')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_tile_server(tiles_root, host='127.0.0.1', port=0):
+    # Inicia o servidor em uma thread daemon e devolve (servidor, porta)
+    server = http.server.ThreadingHTTPServer((host, port), TileRequestHandler)
+    server.daemon_threads = True
+    server.tiles_root = tiles_root
+    thread = threading.Thread(target=server.serve_forever, name='snv-tile-server', daemon=True)
+    thread.start()
+    return server, server.server_address[1]